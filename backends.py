@@ -0,0 +1,845 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cache, store and fetcher interfaces, with App Engine and local
+implementations.
+
+wego talks to memcache, the datastore and urlfetch only through a Cache,
+a Store and a Fetcher, so that it can be run, tested and benchmarked
+without the App Engine services.  MemcacheCache, DatastoreStore and
+UrlfetchFetcher are thin wrappers around the App Engine APIs, which are
+only imported when they are constructed, and MemcachedCache is one
+around python-memcached.  LocalCache emulates memcache
+in memory, SqliteStore keeps blobs in SQLite, and LocalFetcher serves
+fixtures with injectable latency and failures:
+
+  >>> clock = upstream.FakeClock(1000)
+  >>> cache = LocalCache(clock=clock)
+  >>> cache.add('a', [1, 2], 60)
+  True
+  >>> cache.add('a', [3], 60)
+  False
+  >>> clock.now += 61
+  >>> print cache.get('a')
+  None
+  >>> stats = cache.get_stats()
+  >>> stats['hits'], stats['misses']
+  (0, 1)
+
+  >>> compressed = CompressingCache(LocalCache(), threshold=100)
+  >>> compressed.set('page', '<Annotation/>' * 1000)
+  True
+  >>> len(compressed.get('page'))
+  13000
+  >>> compressed.get_stats()['compressed_items']
+  1
+
+  >>> store = SqliteStore()
+  >>> store.put('profile:a', {'nickname': 'a'}, saved_at=1000.0)
+  >>> store.get_multi(['profile:a', 'profile:b'])
+  {'profile:a': (1000.0, {'nickname': 'a'})}
+
+A BufferedStore reads each key at most once per request, and saves
+what the request wrote with one put_multi when it ends:
+
+  >>> buffered = BufferedStore(store)
+  >>> buffered.start_request()
+  >>> buffered.put('profile:b', {'nickname': 'b'}, saved_at=1001.0)
+  >>> sorted(buffered.get_multi(['profile:a', 'profile:b']))
+  ['profile:a', 'profile:b']
+  >>> store.get_multi(['profile:b'])
+  {}
+  >>> buffered.end_request()
+  >>> store.get_multi(['profile:b'])
+  {'profile:b': (1001.0, {'nickname': 'b'})}
+
+  >>> fetcher = LocalFetcher({'http://friendfeed.com/a': 'hello'})
+  >>> fetcher.fetch('http://friendfeed.com/a').content
+  'hello'
+  >>> fetcher.fetch('http://friendfeed.com/b').status_code
+  404
+  >>> call = fetcher.fetch_async('http://friendfeed.com/a')
+  >>> call.get_result().content
+  'hello'
+  >>> fetcher.calls['friendfeed.com']
+  3
+"""
+
+import cPickle as pickle
+import os
+import random
+import sys
+import threading
+import time
+import urlparse
+import zlib
+
+try:
+  import bz2
+except ImportError:
+  bz2 = None
+
+import upstream
+
+# Memcache's limits, in bytes.
+MAX_KEY_SIZE = 250
+MAX_VALUE_SIZE = 1000000
+
+# Memcache treats expirations longer than this as absolute timestamps.
+MAX_RELATIVE_EXPIRATION = 86400 * 30
+
+# The most entities the datastore will put in one call.
+MAX_DATASTORE_PUT = 500
+
+DELETE_NETWORK_FAILURE = 0
+DELETE_ITEM_MISSING = 1
+DELETE_SUCCESSFUL = 2
+
+
+class Cache(object):
+  """The subset of the memcache API used by wego."""
+
+  def get(self, key):
+    """Returns the value for key, or None."""
+    raise NotImplementedError
+
+  def get_multi(self, keys, key_prefix=''):
+    """Returns a dict of the keys that were found to their values."""
+    raise NotImplementedError
+
+  def set(self, key, value, time=0):
+    """Stores value under key.  Returns True on success."""
+    raise NotImplementedError
+
+  def add(self, key, value, time=0):
+    """Stores value only if key is absent.  Returns True on success."""
+    raise NotImplementedError
+
+  def delete(self, key):
+    """Deletes key.  Returns one of the DELETE_* constants."""
+    raise NotImplementedError
+
+  def incr(self, key, delta=1, initial_value=None):
+    """Atomically increments key, returning the new value or None."""
+    raise NotImplementedError
+
+  def decr(self, key, delta=1):
+    """Atomically decrements key, but not below zero, returning the new
+    value or None."""
+    raise NotImplementedError
+
+  def flush_all(self):
+    """Deletes everything.  Returns True on success."""
+    raise NotImplementedError
+
+  def get_stats(self):
+    """Returns a dict with hits, misses, byte_hits, items, bytes and
+    oldest_item_age."""
+    raise NotImplementedError
+
+
+class MemcacheCache(Cache):
+  """A Cache backed by the App Engine memcache service."""
+
+  def __init__(self):
+    from google.appengine.api import memcache
+    self._memcache = memcache
+
+  def get(self, key):
+    return self._memcache.get(key)
+
+  def get_multi(self, keys, key_prefix=''):
+    return self._memcache.get_multi(keys, key_prefix=key_prefix)
+
+  def set(self, key, value, time=0):
+    return self._memcache.set(key, value, time)
+
+  def add(self, key, value, time=0):
+    return self._memcache.add(key, value, time)
+
+  def delete(self, key):
+    return self._memcache.delete(key)
+
+  def incr(self, key, delta=1, initial_value=None):
+    if initial_value is None:
+      return self._memcache.incr(key, delta)
+    # Older SDKs have no initial_value, so seed the counter with add.
+    result = self._memcache.incr(key, delta)
+    if result is None:
+      self._memcache.add(key, initial_value)
+      result = self._memcache.incr(key, delta)
+    return result
+
+  def decr(self, key, delta=1):
+    return self._memcache.decr(key, delta)
+
+  def flush_all(self):
+    return self._memcache.flush_all()
+
+  def get_stats(self):
+    return self._memcache.get_stats()
+
+
+class MemcachedCache(Cache):
+  """A Cache backed by memcached servers, for running outside App Engine
+  with a cache shared by several processes.  Needs python-memcached.
+  """
+
+  def __init__(self, servers):
+    import memcache
+    self._client = memcache.Client(servers)
+
+  def get(self, key):
+    return self._client.get(key)
+
+  def get_multi(self, keys, key_prefix=''):
+    return self._client.get_multi(keys, key_prefix=key_prefix)
+
+  def set(self, key, value, time=0):
+    return bool(self._client.set(key, value, time))
+
+  def add(self, key, value, time=0):
+    return bool(self._client.add(key, value, time))
+
+  def delete(self, key):
+    if self._client.delete(key):
+      return DELETE_SUCCESSFUL
+    return DELETE_NETWORK_FAILURE
+
+  def incr(self, key, delta=1, initial_value=None):
+    result = self._client.incr(key, delta)
+    if result is None and initial_value is not None:
+      self._client.add(key, initial_value)
+      result = self._client.incr(key, delta)
+    return result
+
+  def decr(self, key, delta=1):
+    return self._client.decr(key, delta)
+
+  def flush_all(self):
+    self._client.flush_all()
+    return True
+
+  def get_stats(self):
+    totals = {'hits': 0, 'misses': 0, 'byte_hits': 0, 'items': 0,
+              'bytes': 0, 'oldest_item_age': 0}
+    # memcached counts the bytes it sent rather than the bytes of hits.
+    names = {'get_hits': 'hits', 'get_misses': 'misses',
+             'bytes_written': 'byte_hits', 'curr_items': 'items',
+             'bytes': 'bytes'}
+    for server, stats in self._client.get_stats():
+      for name, total in names.items():
+        totals[total] += int(stats.get(name, 0))
+    return totals
+
+
+class LocalCache(Cache):
+  """An in-memory emulation of memcache.
+
+  Values are pickled on the way in, as they would be by memcache, so
+  callers never share mutable state with the cache and the byte counts
+  in get_stats are realistic.  Keys and values over memcache's size
+  limits are refused.  Nothing is ever evicted for lack of space.
+  """
+
+  def __init__(self, clock=time.time):
+    self._clock = clock
+    self._lock = threading.Lock()
+    self._data = {}
+    self._hits = 0
+    self._misses = 0
+    self._byte_hits = 0
+
+  def _expires_at(self, expiration, now):
+    if not expiration:
+      return None
+    if expiration > MAX_RELATIVE_EXPIRATION:
+      return expiration
+    return now + expiration
+
+  def _lookup(self, key, now):
+    entry = self._data.get(key)
+    if entry is not None and entry[1] is not None and entry[1] <= now:
+      del self._data[key]
+      entry = None
+    return entry
+
+  def _store(self, key, value, expiration, now):
+    if len(key) > MAX_KEY_SIZE:
+      return False
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    if len(data) > MAX_VALUE_SIZE:
+      return False
+    self._data[key] = (data, self._expires_at(expiration, now), now)
+    return True
+
+  def get(self, key):
+    return self.get_multi([key]).get(key)
+
+  def get_multi(self, keys, key_prefix=''):
+    results = {}
+    self._lock.acquire()
+    try:
+      now = self._clock()
+      for key in keys:
+        entry = self._lookup(key_prefix + key, now)
+        if entry is None:
+          self._misses += 1
+        else:
+          self._hits += 1
+          self._byte_hits += len(entry[0])
+          results[key] = entry[0]
+    finally:
+      self._lock.release()
+    for key, data in results.items():
+      results[key] = pickle.loads(data)
+    return results
+
+  def set(self, key, value, time=0):
+    self._lock.acquire()
+    try:
+      return self._store(key, value, time, self._clock())
+    finally:
+      self._lock.release()
+
+  def add(self, key, value, time=0):
+    self._lock.acquire()
+    try:
+      now = self._clock()
+      if self._lookup(key, now) is not None:
+        return False
+      return self._store(key, value, time, now)
+    finally:
+      self._lock.release()
+
+  def delete(self, key):
+    self._lock.acquire()
+    try:
+      if self._lookup(key, self._clock()) is None:
+        return DELETE_ITEM_MISSING
+      del self._data[key]
+      return DELETE_SUCCESSFUL
+    finally:
+      self._lock.release()
+
+  def incr(self, key, delta=1, initial_value=None):
+    self._lock.acquire()
+    try:
+      now = self._clock()
+      entry = self._lookup(key, now)
+      if entry is None:
+        if initial_value is None:
+          return None
+        value, expires_at = initial_value, None
+      else:
+        value, expires_at = pickle.loads(entry[0]), entry[1]
+        if not isinstance(value, (int, long)):
+          return None
+      # Like memcache, counters never go below zero.
+      value = max(0, value + delta)
+      self._data[key] = (pickle.dumps(value), expires_at, now)
+      return value
+    finally:
+      self._lock.release()
+
+  def decr(self, key, delta=1):
+    return self.incr(key, -delta)
+
+  def flush_all(self):
+    self._lock.acquire()
+    try:
+      self._data.clear()
+    finally:
+      self._lock.release()
+    return True
+
+  def get_stats(self):
+    self._lock.acquire()
+    try:
+      now = self._clock()
+      for key in self._data.keys():
+        self._lookup(key, now)
+      entries = self._data.values()
+      oldest = 0
+      if entries:
+        oldest = int(now - min([entry[2] for entry in entries]))
+      return {'hits': self._hits,
+              'misses': self._misses,
+              'byte_hits': self._byte_hits,
+              'items': len(entries),
+              'bytes': sum([len(entry[0]) for entry in entries]),
+              'oldest_item_age': oldest}
+    finally:
+      self._lock.release()
+
+
+class CompressingCache(Cache):
+  """A Cache that compresses large values before storing them in another.
+
+  Values are pickled, and compressed with codec if the pickle is at
+  least threshold bytes, and stored as a string with a leading flag byte
+  naming the codec.  A value still over MAX_VALUE_SIZE is compressed
+  with bz2, where available, before it is refused.  Integers are stored
+  as they are, so that incr still works on them.
+  """
+
+  FLAGS = {'\x00': None, '\x01': 'zlib', '\x02': 'bz2'}
+
+  def __init__(self, cache, threshold=1024, codec='zlib'):
+    self.cache = cache
+    self.threshold = threshold
+    self.codec = codec
+    self.compressed_items = 0
+    self.bytes_before = 0
+    self.bytes_after = 0
+    self.refused_items = 0
+
+  def _compress(self, codec, data):
+    if codec == 'bz2':
+      return '\x02' + bz2.compress(data)
+    return '\x01' + zlib.compress(data)
+
+  def _encode(self, value):
+    if isinstance(value, (int, long)) and not isinstance(value, bool):
+      return value
+    data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+    if len(data) < self.threshold:
+      return '\x00' + data
+    encoded = self._compress(self.codec, data)
+    if len(encoded) > MAX_VALUE_SIZE and self.codec != 'bz2' and bz2:
+      encoded = self._compress('bz2', data)
+    if len(encoded) > len(data):
+      encoded = '\x00' + data
+    else:
+      self.compressed_items += 1
+      self.bytes_before += len(data)
+      self.bytes_after += len(encoded)
+    if len(encoded) > MAX_VALUE_SIZE:
+      self.refused_items += 1
+      return None
+    return encoded
+
+  def _decode(self, value):
+    if not isinstance(value, str) or not value:
+      return value
+    codec = self.FLAGS.get(value[0], False)
+    if codec is False:
+      return value
+    data = value[1:]
+    if codec == 'zlib':
+      data = zlib.decompress(data)
+    elif codec == 'bz2':
+      data = bz2.decompress(data)
+    return pickle.loads(data)
+
+  def get(self, key):
+    return self._decode(self.cache.get(key))
+
+  def get_multi(self, keys, key_prefix=''):
+    results = self.cache.get_multi(keys, key_prefix=key_prefix)
+    for key, value in results.items():
+      results[key] = self._decode(value)
+    return results
+
+  def set(self, key, value, time=0):
+    encoded = self._encode(value)
+    return encoded is not None and self.cache.set(key, encoded, time)
+
+  def add(self, key, value, time=0):
+    encoded = self._encode(value)
+    return encoded is not None and self.cache.add(key, encoded, time)
+
+  def delete(self, key):
+    return self.cache.delete(key)
+
+  def incr(self, key, delta=1, initial_value=None):
+    return self.cache.incr(key, delta, initial_value)
+
+  def decr(self, key, delta=1):
+    return self.cache.decr(key, delta)
+
+  def flush_all(self):
+    return self.cache.flush_all()
+
+  def get_stats(self):
+    """Adds compressed_items, bytes_before_compression and
+    bytes_after_compression, for the values this instance stored, and
+    refused_items, to the stats of the underlying cache."""
+    stats = dict(self.cache.get_stats() or {})
+    stats.update({'compressed_items': self.compressed_items,
+                  'bytes_before_compression': self.bytes_before,
+                  'bytes_after_compression': self.bytes_after,
+                  'refused_items': self.refused_items})
+    return stats
+
+
+class Store(object):
+  """A durable key-value store for the last known good results.
+
+  Unlike a Cache, a Store never drops entries on its own, and records
+  when each value was saved.
+  """
+
+  def get_multi(self, keys):
+    """Returns a dict of the keys found to (saved_at, value) pairs."""
+    raise NotImplementedError
+
+  def put(self, key, value, saved_at=None):
+    """Saves value under key, as of saved_at or now."""
+    self.put_multi([(key, value, saved_at)])
+
+  def put_multi(self, items):
+    """Saves a list of (key, value, saved_at) triples, where saved_at may
+    be None for now."""
+    raise NotImplementedError
+
+  def delete(self, key):
+    """Deletes key, if it is present."""
+    raise NotImplementedError
+
+
+class DatastoreStore(Store):
+  """A Store backed by the App Engine datastore."""
+
+  def __init__(self):
+    from google.appengine.ext import db
+
+    class StoredBlob(db.Model):
+      value = db.BlobProperty()
+      saved_at = db.FloatProperty()
+
+    self._db = db
+    self._model = StoredBlob
+
+  def _key(self, key):
+    # Key names may not start with a digit or look like __name__.
+    return self._db.Key.from_path(self._model.kind(), 'k:' + key)
+
+  def get_multi(self, keys):
+    results = {}
+    entities = self._db.get([self._key(key) for key in keys])
+    for key, entity in zip(keys, entities):
+      if entity is not None:
+        results[key] = (entity.saved_at, pickle.loads(entity.value))
+    return results
+
+  def put_multi(self, items):
+    now = time.time()
+    entities = [self._model(key_name='k:' + key, saved_at=saved_at or now,
+                            value=self._db.Blob(pickle.dumps(value, 2)))
+                for key, value, saved_at in items]
+    for i in xrange(0, len(entities), MAX_DATASTORE_PUT):
+      self._db.put(entities[i:i + MAX_DATASTORE_PUT])
+
+  def delete(self, key):
+    self._db.delete(self._key(key))
+
+
+class SqliteStore(Store):
+  """A Store kept in a SQLite database, in memory unless given a path."""
+
+  def __init__(self, path=':memory:'):
+    import sqlite3
+    self._lock = threading.Lock()
+    self._connection = sqlite3.connect(path, check_same_thread=False)
+    self._connection.execute(
+      'CREATE TABLE IF NOT EXISTS blobs '
+      '(key TEXT PRIMARY KEY, saved_at REAL, value BLOB)')
+    self._connection.commit()
+
+  def get_multi(self, keys):
+    if not keys:
+      return {}
+    self._lock.acquire()
+    try:
+      rows = self._connection.execute(
+        'SELECT key, saved_at, value FROM blobs WHERE key IN (%s)' %
+        ', '.join(['?'] * len(keys)), list(keys)).fetchall()
+    finally:
+      self._lock.release()
+    return dict([(str(key), (saved_at, pickle.loads(str(value))))
+                 for key, saved_at, value in rows])
+
+  def put_multi(self, items):
+    now = time.time()
+    rows = [(key, saved_at or now, buffer(pickle.dumps(value, 2)))
+            for key, value, saved_at in items]
+    self._lock.acquire()
+    try:
+      self._connection.executemany(
+        'INSERT OR REPLACE INTO blobs (key, saved_at, value) VALUES (?, ?, ?)',
+        rows)
+      self._connection.commit()
+    finally:
+      self._lock.release()
+
+  def delete(self, key):
+    self._lock.acquire()
+    try:
+      self._connection.execute('DELETE FROM blobs WHERE key = ?', (key,))
+      self._connection.commit()
+    finally:
+      self._lock.release()
+
+
+class BufferedStore(Store):
+  """Wraps a Store so that a request reads each key from it at most once,
+  and saves everything it wrote in one put_multi when it ends.
+
+  Reads see the request's own writes.  Outside of a request, reads and
+  writes go straight to the store.
+  """
+
+  def __init__(self, store):
+    self.store = store
+    self._local = threading.local()
+
+  def start_request(self):
+    self._local.read = {}
+    self._local.written = {}
+
+  def end_request(self):
+    """Saves what the request wrote, raising whatever the store raises."""
+    written = getattr(self._local, 'written', None)
+    self._local.read = self._local.written = None
+    if written:
+      self.store.put_multi([(key, value, saved_at) for key, (saved_at, value)
+                            in written.items()])
+
+  def get_multi(self, keys):
+    read = getattr(self._local, 'read', None)
+    if read is None:
+      return self.store.get_multi(keys)
+    missing = [key for key in keys if key not in read]
+    if missing:
+      found = self.store.get_multi(missing)
+      for key in missing:
+        read[key] = found.get(key)
+    return dict([(key, read[key]) for key in keys if read[key] is not None])
+
+  def put_multi(self, items):
+    written = getattr(self._local, 'written', None)
+    if written is None:
+      self.store.put_multi(items)
+      return
+    now = time.time()
+    for key, value, saved_at in items:
+      written[key] = self._local.read[key] = (saved_at or now, value)
+
+  def delete(self, key):
+    written = getattr(self._local, 'written', None)
+    if written is not None:
+      written.pop(key, None)
+      self._local.read[key] = None
+    self.store.delete(key)
+
+
+class FetchError(Exception):
+  """Raised by a Fetcher when a fetch fails without a response."""
+
+
+class FetchResponse(object):
+  """A fetched response, with the attributes of a urlfetch response."""
+
+  def __init__(self, content='', status_code=200, headers=None):
+    self.content = content
+    self.status_code = status_code
+    self.headers = headers or {}
+
+
+class Fetcher(object):
+  """Fetches urls.  errors lists the exceptions raised on failure."""
+
+  errors = (FetchError,)
+
+  def fetch(self, url, deadline=None):
+    """Returns a response with status_code, content and headers."""
+    raise NotImplementedError
+
+  def fetch_async(self, url, deadline=None):
+    """Starts fetching url.
+
+    Returns:
+      An object whose get_result() waits for the fetch, then returns the
+      response or raises one of errors.  Fetchers that cannot fetch
+      concurrently fetch right away.
+    """
+    return FetchCall(self.fetch, url, deadline)
+
+
+class FetchCall(object):
+  """A call of a fetch function, made right away or in a thread."""
+
+  def __init__(self, fetch, url, deadline=None, background=False):
+    self._fetch = fetch
+    self._url = url
+    self._deadline = deadline
+    self._response = None
+    self._exc_info = None
+    self._thread = None
+    if background:
+      self._thread = threading.Thread(target=self._run)
+      self._thread.setDaemon(True)
+      self._thread.start()
+    else:
+      self._run()
+
+  def _run(self):
+    try:
+      self._response = self._fetch(self._url, deadline=self._deadline)
+    except Exception:
+      self._exc_info = sys.exc_info()
+
+  def get_result(self):
+    if self._thread is not None:
+      self._thread.join()
+    if self._exc_info is not None:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._response
+
+
+class UrlfetchFetcher(Fetcher):
+  """A Fetcher backed by the App Engine urlfetch service."""
+
+  def __init__(self):
+    from google.appengine.api import urlfetch
+    self._urlfetch = urlfetch
+    self.errors = (urlfetch.Error,)
+
+  def fetch(self, url, deadline=None):
+    return self._urlfetch.fetch(url, deadline=deadline)
+
+  def fetch_async(self, url, deadline=None):
+    # Older SDKs have no asynchronous urlfetch.
+    if not hasattr(self._urlfetch, 'create_rpc'):
+      return Fetcher.fetch_async(self, url, deadline)
+    rpc = self._urlfetch.create_rpc(deadline=deadline)
+    self._urlfetch.make_fetch_call(rpc, url)
+    return rpc
+
+
+class LocalFetcher(Fetcher):
+  """A Fetcher that serves fixtures, for tests and benchmarks.
+
+  Fixtures map urls to responses.  A response may be a FetchResponse, a
+  string to be served with a 200, or a function of the url returning
+  either.  Urls without a fixture get the result of the default function
+  if there is one, otherwise a real fetch if network is True, otherwise
+  a 404.
+
+  latency is the number of seconds every fetch takes, or a function of
+  the url returning it.  A fetch fails with FetchError if its url is in
+  fail_urls, or with probability failure_rate.  calls counts the fetches
+  made to each host.
+  """
+
+  def __init__(self, fixtures=None, default=None, network=False, latency=0,
+               failure_rate=0, fail_urls=(), sleep=time.sleep, seed=0):
+    self.fixtures = dict(fixtures or {})
+    self.default = default
+    self.network = network
+    self.latency = latency
+    self.failure_rate = failure_rate
+    self.fail_urls = set(fail_urls)
+    self.calls = {}
+    self._sleep = sleep
+    self._random = random.Random(seed)
+    self._lock = threading.Lock()
+
+  def fetch_async(self, url, deadline=None):
+    # Latency is slept in a thread, so that fetches overlap as they would
+    # with urlfetch.
+    return FetchCall(self.fetch, url, deadline, background=True)
+
+  def fetch(self, url, deadline=None):
+    host = urlparse.urlparse(url)[1]
+    self._lock.acquire()
+    try:
+      self.calls[host] = self.calls.get(host, 0) + 1
+      failed = (url in self.fail_urls or
+                self._random.random() < self.failure_rate)
+    finally:
+      self._lock.release()
+
+    latency = self.latency
+    if callable(latency):
+      latency = latency(url)
+    if latency:
+      if deadline is not None and latency > deadline:
+        self._sleep(deadline)
+        raise FetchError('%s timed out after %ss' % (url, deadline))
+      self._sleep(latency)
+    if failed:
+      raise FetchError('injected failure for %s' % url)
+
+    response = self.fixtures.get(url)
+    if response is None and self.default is not None:
+      response = self.default
+    if callable(response):
+      response = response(url)
+    if response is None:
+      if self.network:
+        return self._fetch_network(url, deadline)
+      response = FetchResponse(status_code=404)
+    if isinstance(response, basestring):
+      response = FetchResponse(response)
+    return response
+
+  def _fetch_network(self, url, deadline):
+    # Only needed outside App Engine, and slow to import.
+    import urllib2
+    try:
+      result = urllib2.urlopen(url, timeout=deadline or upstream.FETCH_TIMEOUT)
+    except urllib2.HTTPError, e:
+      return FetchResponse(e.read(), e.code, dict(e.info()))
+    except (urllib2.URLError, IOError), e:
+      raise FetchError('%s: %s' % (url, e))
+    return FetchResponse(result.read(), result.getcode(), dict(result.info()))
+
+
+def default_backends():
+  """Returns the (cache, fetcher) to use in this environment.
+
+  The App Engine services are used under the App Engine runtime and the
+  dev server, and the local stand-ins everywhere else, except that the
+  memcached servers listed, comma separated, in the WEGO_MEMCACHED
+  environment variable are used if it is set.  Either cache is wrapped
+  in a CompressingCache.
+  """
+  if os.environ.get('SERVER_SOFTWARE'):
+    try:
+      return CompressingCache(MemcacheCache()), UrlfetchFetcher()
+    except ImportError:
+      pass
+  servers = os.environ.get('WEGO_MEMCACHED')
+  if servers:
+    cache = MemcachedCache(servers.split(','))
+  else:
+    cache = LocalCache()
+  return CompressingCache(cache), LocalFetcher(network=True)
+
+
+def default_store():
+  """Returns the Store to use in this environment.
+
+  The datastore is used under the App Engine runtime and the dev server.
+  Elsewhere results are kept in the SQLite file named by the WEGO_STORE
+  environment variable, or in memory if it is not set.
+  """
+  if os.environ.get('SERVER_SOFTWARE'):
+    try:
+      return DatastoreStore()
+    except ImportError:
+      pass
+  return SqliteStore(os.environ.get('WEGO_STORE', ':memory:'))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-call and per-decoration cost of decorator.decorator.
+
+The caller mirrors wego.cacheable on a cache hit, so the per-call numbers
+are the overhead a @cacheable handler pays before doing any real work.
+'eval lambda' is the wrapper decorator.decorator used to generate, kept
+here for comparison.
+
+Run from the top of the tree:
+
+  python benchmarks/bench_decorator.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import decorator
+
+
+_cache = {}
+
+
+def call(f, *args, **kwargs):
+  """A stand-in for cacheable.call that always hits the cache."""
+  local_key = args[0]
+  result = _cache.get(local_key)
+  if result is None:
+    result = _cache[local_key] = f(*args, **kwargs)
+  return result
+
+
+def eval_lambda_decorator(caller):
+  """The previous implementation of decorator.decorator."""
+  def _decorator(func):
+    infodict = decorator.getinfo(func)
+    src = "lambda %(signature)s: _call_(_func_, %(signature)s)" % infodict
+    dec_func = eval(src, dict(_func_=func, _call_=caller))
+    return decorator.update_wrapper(dec_func, func, infodict)
+  return _decorator
+
+
+def handler(request, nickname):
+  return nickname
+
+
+def best(stmt, number):
+  """Returns the best time per call of stmt, in microseconds."""
+  return min(timeit.Timer(stmt).repeat(repeat=5, number=number)) / number * 1e6
+
+
+def main():
+  candidates = [('eval lambda', eval_lambda_decorator(call)),
+                ('closure', decorator.decorator(call))]
+
+  plain = best(lambda: call(handler, '/friendfeed/dewitt/', 'dewitt'), 100000)
+  print '%-16s %8.3f us/call' % ('undecorated', plain)
+  for name, dec in candidates:
+    wrapped = dec(handler)
+    per_call = best(lambda: wrapped('/friendfeed/dewitt/', 'dewitt'), 100000)
+    print '%-16s %8.3f us/call (+%.3f us)' % (name, per_call, per_call - plain)
+
+  # Decorating is what happens at import time, once per handler.
+  for name, dec in candidates:
+    per_decoration = best(lambda: dec(handler), 2000)
+    print '%-16s %8.3f us/decoration' % (name, per_decoration)
+
+
+if __name__ == '__main__':
+  main()
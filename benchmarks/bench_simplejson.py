@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Throughput of simplejson.dumps on the payload shapes wego produces.
+
+Run from the top of the tree:
+
+  python benchmarks/bench_simplejson.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import simplejson
+
+
+def nickname_list(count=250):
+  """Returns a flat list of ASCII nicknames, like get_friend_nicknames."""
+  return ['friend%04d' % i for i in xrange(count)]
+
+
+def profile(count=250):
+  """Returns a dict shaped like a FriendFeed profile with subscriptions."""
+  subscriptions = [{'id': '%032x' % i,
+                    'name': 'Friend Number %d' % i,
+                    'nickname': 'friend%04d' % i,
+                    'profileUrl': 'http://friendfeed.com/friend%04d' % i}
+                   for i in xrange(count)]
+  return {'id': '%032x' % 0,
+          'name': 'DeWitt Clinton',
+          'nickname': 'dewitt',
+          'profileUrl': 'http://friendfeed.com/dewitt',
+          'subscriptions': subscriptions}
+
+
+def run(name, payload, number=200):
+  """Times simplejson.dumps(payload) and prints calls/s and MB/s."""
+  size = len(simplejson.dumps(payload))
+  timer = timeit.Timer(lambda: simplejson.dumps(payload))
+  best = min(timer.repeat(repeat=5, number=number)) / number
+  print '%-24s %8d bytes %10.0f calls/s %8.2f MB/s' % (
+    name, size, 1.0 / best, size / best / (1024 * 1024))
+
+
+def main():
+  run('nicknames (25)', nickname_list(25), number=5000)
+  run('nicknames (250)', nickname_list(250), number=1000)
+  run('profile (25)', profile(25), number=1000)
+  run('profile (250)', profile(250), number=100)
+
+
+if __name__ == '__main__':
+  main()
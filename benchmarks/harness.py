@@ -0,0 +1,133 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Timing, reporting and baseline comparison shared by the benchmarks.
+
+A benchmark is a name, a function of no arguments, and the number of
+calls per timed run.  Each benchmark is warmed up with one untimed run,
+then timed repeat times.  The minimum is the figure least disturbed by
+the rest of the machine, and the median shows how noisy that was.
+"""
+
+import gc
+import optparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import simplejson
+
+
+class Benchmark(object):
+  """A function to time, called number times per timed run."""
+
+  def __init__(self, name, func, number=1000):
+    self.name = name
+    self.func = func
+    self.number = number
+
+
+def measure(func, number, repeat=7):
+  """Times func and returns min and median microseconds per call."""
+  timer = timeit.Timer(func)
+  timer.timeit(number)
+  gc.collect()
+  runs = sorted([t / number * 1e6 for t in timer.repeat(repeat, number)])
+  return {'min_us': runs[0], 'median_us': runs[len(runs) / 2],
+          'number': number, 'repeat': repeat}
+
+
+def compare(results, baseline, tolerance, higher_is_better=()):
+  """Prints each metric against the baseline.
+
+  Args:
+    results: A dict of metric names to numbers.
+    baseline: A dict of the same shape from an earlier run.
+    tolerance: The relative change that counts as a regression.
+    higher_is_better: Metrics that regress when they go down rather
+      than up.
+  Returns:
+    The names of the metrics that regressed.
+  """
+  regressions = []
+  for name in sorted(results):
+    old, new = baseline.get(name), results[name]
+    if not old:
+      continue
+    change = (new - old) / float(old)
+    if name in higher_is_better:
+      worse = change < -tolerance
+    else:
+      worse = change > tolerance
+    print '%-48s %12.3f -> %12.3f  %+7.1f%%%s' % (
+      name, old, new, change * 100, worse and '  REGRESSION' or '')
+    if worse:
+      regressions.append(name)
+  return regressions
+
+
+def save(report, path):
+  """Saves a report as JSON."""
+  output = open(path, 'w')
+  try:
+    simplejson.dump(report, output, indent=2, sort_keys=True)
+  finally:
+    output.close()
+
+
+def load(path):
+  """Loads a report saved by save."""
+  return simplejson.load(open(path))
+
+
+def main(benchmarks, argv):
+  """Runs benchmarks as selected by the command line in argv.
+
+  Returns 1 if --compare found a regression, otherwise 0.
+  """
+  parser = optparse.OptionParser(usage='%prog [options] [name filter...]')
+  parser.add_option('--repeat', type='int', default=7,
+                    help='timed runs per benchmark')
+  parser.add_option('--scale', type='float', default=1.0,
+                    help='multiply the calls per run by this')
+  parser.add_option('--output', help='save the results as JSON here')
+  parser.add_option('--compare', help='saved results to compare with')
+  parser.add_option('--tolerance', type='float', default=0.10,
+                    help='relative slowdown of min_us that is a regression')
+  options, filters = parser.parse_args(argv)
+
+  results = {}
+  for benchmark in benchmarks:
+    if filters and not [f for f in filters if f in benchmark.name]:
+      continue
+    number = max(1, int(benchmark.number * options.scale))
+    result = measure(benchmark.func, number, options.repeat)
+    results[benchmark.name] = result
+    print '%-48s %10.3f us min %10.3f us median' % (
+      benchmark.name, result['min_us'], result['median_us'])
+
+  if options.output:
+    save(results, options.output)
+  if options.compare:
+    baseline = load(options.compare)
+    print
+    current = dict([(name, result['min_us'])
+                    for name, result in results.items()])
+    previous = dict([(name, result['min_us'])
+                     for name, result in baseline.items()])
+    if compare(current, previous, options.tolerance):
+      return 1
+  return 0
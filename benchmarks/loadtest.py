@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""End-to-end load test of the wego WSGI application.
+
+Replays a mix of cref, annotation, opensearch and 404 traffic against
+wego.dispatcher.get_app(), with FriendFeed and ego-ego replaced by a fake
+upstream with configurable latency, and memcache by backends.LocalCache.
+Requests are either made as direct WSGI calls or over HTTP to a local
+wsgiref server.
+
+The report covers throughput, latency percentiles, the cache hit ratio
+and upstream call counts.  It can be saved as JSON and compared with a
+previous run:
+
+  python benchmarks/loadtest.py --sdk ~/google_appengine \\
+      --requests 5000 --output baseline.json
+  ... make changes ...
+  python benchmarks/loadtest.py --sdk ~/google_appengine \\
+      --requests 5000 --compare baseline.json
+
+--sdk adds the App Engine SDK and its bundled webob and django to the
+path; it may be left out if they are importable already.
+"""
+
+import logging
+import optparse
+import os
+import random
+import sys
+import threading
+import time
+import urllib2
+
+import harness
+import sharding
+from server import add_sdk_to_path
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Metrics where a larger value is better; for the rest, smaller is better.
+HIGHER_IS_BETTER = ('throughput', 'cache_hit_ratio')
+
+
+class FakeUpstream(object):
+  """Deterministic FriendFeed profiles and ego-ego annotation files.
+
+  users is the number of distinct users, each with a random number of
+  subscriptions averaging friends.
+  """
+
+  def __init__(self, users, friends, seed):
+    import simplejson
+    rand = random.Random(seed)
+    self.nicknames = ['user%05d' % i for i in xrange(users)]
+    self.profiles = {}
+    self._friend_counts = {}
+    for nickname in self.nicknames:
+      count = max(0, int(rand.gauss(friends, friends / 3.0)))
+      # The user is always the first "friend" in their own search engine.
+      self._friend_counts[nickname] = count + 1
+      subscriptions = [{'nickname': rand.choice(self.nicknames),
+                        'name': 'Someone'} for i in xrange(count)]
+      self.profiles[nickname] = simplejson.dumps(
+        {'nickname': nickname, 'name': nickname.title(),
+         'subscriptions': subscriptions})
+
+  def friend_count(self, nickname):
+    return self._friend_counts[nickname]
+
+  def __call__(self, url):
+    import backends
+    if url.startswith('http://friendfeed.com/api/user/'):
+      nickname = url.split('/')[5]
+      profile = self.profiles.get(nickname)
+      if profile is None:
+        return backends.FetchResponse(status_code=404)
+      return backends.FetchResponse(profile)
+    if url.startswith('http://ego-ego.appspot.com/friendfeed/'):
+      nickname = url.split('/')[4]
+      return backends.FetchResponse(
+        '<Annotation about="http://friendfeed.com/%s/*">'
+        '<Label name="include"/></Annotation>' % nickname)
+    return backends.FetchResponse(status_code=404)
+
+
+class TrafficMix(object):
+  """Generates request paths with a skewed choice of users."""
+
+  def __init__(self, upstream, weights, seed):
+    self._upstream = upstream
+    self._rand = random.Random(seed)
+    self._kinds = []
+    for kind, weight in weights:
+      self._kinds.extend([kind] * weight)
+
+  def _nickname(self):
+    # Popularity roughly follows a power law, like real users.
+    nicknames = self._upstream.nicknames
+    index = int(len(nicknames) * self._rand.random() ** 3)
+    return nicknames[index]
+
+  def next(self):
+    kind = self._rand.choice(self._kinds)
+    if kind == '404':
+      return kind, '/wp-login.php?%d' % self._rand.randrange(1000)
+    nickname = self._nickname()
+    if kind == 'osd':
+      return kind, '/friendfeed/%s/osd/' % nickname
+    if kind == 'cref':
+      return kind, '/friendfeed/%s/cref/' % nickname
+    shards = sharding.shard_count(self._upstream.friend_count(nickname),
+                                  sharding.DEFAULT_ANNOTATION_BYTES)
+    return kind, '/friendfeed/%s/annotations/%d-of-%d/' % (
+      nickname, self._rand.randrange(shards), shards)
+
+
+def call_wsgi(app, path):
+  """Makes a GET request straight through the WSGI interface."""
+  path, _, query = path.partition('?')
+  environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path,
+             'QUERY_STRING': query, 'SCRIPT_NAME': '',
+             'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+             'SERVER_PROTOCOL': 'HTTP/1.1', 'wsgi.url_scheme': 'http',
+             'wsgi.input': None, 'wsgi.errors': sys.stderr,
+             'wsgi.multithread': True, 'wsgi.multiprocess': False,
+             'wsgi.run_once': False, 'wsgi.version': (1, 0)}
+  status = []
+  def start_response(status_line, headers, exc_info=None):
+    status.append(status_line)
+  body = app(environ, start_response)
+  size = sum([len(chunk) for chunk in body])
+  if hasattr(body, 'close'):
+    body.close()
+  return int(status[0].split()[0]), size
+
+
+def serve_http(app):
+  """Starts a threaded wsgiref server on a free port; returns its url."""
+  import SocketServer
+  from wsgiref import simple_server
+
+  class Server(SocketServer.ThreadingMixIn, simple_server.WSGIServer):
+    daemon_threads = True
+
+  class Handler(simple_server.WSGIRequestHandler):
+    def log_message(self, *args):
+      pass
+
+  server = simple_server.make_server('127.0.0.1', 0, app, Server, Handler)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.setDaemon(True)
+  thread.start()
+  return 'http://127.0.0.1:%d' % server.server_port
+
+
+def call_http(base_url, path):
+  """Makes a GET request to the local server."""
+  try:
+    response = urllib2.urlopen(base_url + path)
+  except urllib2.HTTPError, e:
+    return e.code, len(e.read())
+  return response.getcode(), len(response.read())
+
+
+def percentile(values, fraction):
+  """Returns the nearest-rank percentile of sorted values."""
+  if not values:
+    return 0.0
+  index = min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1)
+  return values[max(0, index)]
+
+
+def run(options):
+  """Runs one load test and returns the report as a dict."""
+  os.environ.setdefault('SERVER_SOFTWARE', 'Loadtest/1.0')
+  if not options.verbose:
+    # Concurrent cache fills race on add(), which wego logs as warnings.
+    logging.getLogger().setLevel(logging.ERROR)
+  sys.path.insert(0, ROOT)
+  import backends
+  import wego
+
+  upstream = FakeUpstream(options.users, options.friends, options.seed)
+  rand = random.Random(options.seed)
+  def latency(url):
+    return max(0.0, rand.gauss(options.latency, options.jitter)) / 1000.0
+  wego.cache = backends.CompressingCache(backends.LocalCache())
+  wego.fetcher = backends.LocalFetcher(
+    default=upstream, latency=latency, failure_rate=options.failure_rate,
+    seed=options.seed)
+
+  weights = [('cref', options.cref), ('annotations', options.annotations),
+             ('osd', options.osd), ('404', options.not_found)]
+  mix = TrafficMix(upstream, weights, options.seed)
+  paths = [mix.next() for i in xrange(options.warmup + options.requests)]
+  warmup, paths = paths[:options.warmup], paths[options.warmup:]
+
+  app = wego.dispatcher.get_app()
+  if options.mode == 'http':
+    base_url = serve_http(app)
+    call = lambda path: call_http(base_url, path)
+  else:
+    call = lambda path: call_wsgi(app, path)
+
+  for kind, path in warmup:
+    call(path)
+  stats_before = wego.cache.get_stats()
+  calls_before = dict(wego.fetcher.calls)
+
+  samples = []
+  lock = threading.Lock()
+  queue = list(reversed(paths))
+  def worker():
+    while True:
+      lock.acquire()
+      try:
+        if not queue:
+          return
+        kind, path = queue.pop()
+      finally:
+        lock.release()
+      start = time.time()
+      status, size = call(path)
+      elapsed = time.time() - start
+      lock.acquire()
+      samples.append((kind, status, size, elapsed))
+      lock.release()
+
+  start = time.time()
+  threads = [threading.Thread(target=worker)
+             for i in xrange(options.concurrency)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  wall = time.time() - start
+
+  stats_after = wego.cache.get_stats()
+  hits = stats_after['hits'] - stats_before['hits']
+  misses = stats_after['misses'] - stats_before['misses']
+  upstream_calls = {}
+  for host, count in wego.fetcher.calls.items():
+    upstream_calls[host] = count - calls_before.get(host, 0)
+
+  def summarize(selected):
+    latencies = sorted([sample[3] * 1000 for sample in selected])
+    return {'requests': len(selected),
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99)}
+
+  statuses = {}
+  for sample in samples:
+    statuses[str(sample[1])] = statuses.get(str(sample[1]), 0) + 1
+  report = summarize(samples)
+  report.update({
+    'throughput': len(samples) / wall,
+    'bytes': sum([sample[2] for sample in samples]),
+    'cache_hit_ratio': hits / float(max(1, hits + misses)),
+    'upstream_calls': sum(upstream_calls.values()),
+    'upstream_calls_by_host': upstream_calls,
+    'statuses': statuses,
+    'by_kind': dict([(kind, summarize([s for s in samples if s[0] == kind]))
+                     for kind, weight in weights if weight]),
+    'options': options.__dict__,
+  })
+  return report
+
+
+def print_report(report):
+  print 'requests:        %d' % report['requests']
+  print 'throughput:      %.1f req/s' % report['throughput']
+  print 'latency (ms):    p50 %.2f  p95 %.2f  p99 %.2f' % (
+    report['p50_ms'], report['p95_ms'], report['p99_ms'])
+  print 'cache hit ratio: %.3f' % report['cache_hit_ratio']
+  print 'upstream calls:  %d %r' % (
+    report['upstream_calls'], report['upstream_calls_by_host'])
+  print 'statuses:        %r' % report['statuses']
+  for kind, summary in sorted(report['by_kind'].items()):
+    print '  %-12s %6d req  p50 %8.2f  p95 %8.2f  p99 %8.2f ms' % (
+      kind, summary['requests'], summary['p50_ms'], summary['p95_ms'],
+      summary['p99_ms'])
+
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--sdk', help='path to the App Engine SDK')
+  parser.add_option('--mode', choices=['wsgi', 'http'], default='wsgi',
+                    help='call the app directly or over local HTTP')
+  parser.add_option('--requests', type='int', default=2000)
+  parser.add_option('--warmup', type='int', default=200)
+  parser.add_option('--concurrency', type='int', default=1)
+  parser.add_option('--users', type='int', default=500)
+  parser.add_option('--friends', type='int', default=60,
+                    help='mean subscriptions per user')
+  parser.add_option('--latency', type='float', default=20.0,
+                    help='mean upstream latency in ms')
+  parser.add_option('--jitter', type='float', default=10.0,
+                    help='standard deviation of upstream latency in ms')
+  parser.add_option('--failure-rate', type='float', default=0.0,
+                    help='fraction of upstream fetches that fail')
+  parser.add_option('--cref', type='int', default=20,
+                    help='relative weight of cref requests')
+  parser.add_option('--annotations', type='int', default=60,
+                    help='relative weight of annotation requests')
+  parser.add_option('--osd', type='int', default=10,
+                    help='relative weight of opensearch requests')
+  parser.add_option('--not-found', type='int', default=10,
+                    help='relative weight of 404 requests')
+  parser.add_option('--seed', type='int', default=0)
+  parser.add_option('--verbose', action='store_true', default=False,
+                    help='show warnings logged by the application')
+  parser.add_option('--output', help='save the report as JSON here')
+  parser.add_option('--compare', help='a saved report to compare with')
+  parser.add_option('--tolerance', type='float', default=0.10,
+                    help='relative change that counts as a regression')
+  options, args = parser.parse_args(argv)
+  if options.sdk:
+    add_sdk_to_path(options.sdk)
+
+  report = run(options)
+  print_report(report)
+
+  if options.output:
+    harness.save(report, options.output)
+  if options.compare:
+    baseline = harness.load(options.compare)
+    print
+    metrics = ('throughput', 'p50_ms', 'p95_ms', 'p99_ms',
+               'cache_hit_ratio', 'upstream_calls')
+    current = dict([(metric, report[metric]) for metric in metrics])
+    if harness.compare(current, baseline, options.tolerance,
+                       HIGHER_IS_BETTER):
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmarks for the components on every request's path.
+
+Times URI template compilation and routing in wsgidispatcher, the call
+overhead of decorator.decorator, simplejson on profile-shaped payloads,
+and TemplateResponse rendering.  Prove an optimization by saving a
+baseline before the change and comparing after it:
+
+  python benchmarks/microbench.py --output before.json
+  ... make changes ...
+  python benchmarks/microbench.py --compare before.json
+
+Arguments filter the benchmarks by name, e.g. 'dispatch' or 'simplejson'.
+The TemplateResponse benchmarks are skipped unless webob and the App
+Engine template module are importable.
+"""
+
+import os
+import sys
+
+import bench_decorator
+import bench_simplejson
+import harness
+
+import decorator
+import simplejson
+import wsgidispatcher
+
+# The templates wego actually routes, in the order it adds them.
+WEGO_TEMPLATES = [
+  '/',
+  '/faq/',
+  '/friendfeed/{nickname:word}/',
+  '/friendfeed/{nickname:word}/osd/',
+  '/friendfeed/{nickname:word}/cref/',
+  '/friendfeed/{nickname:word}/annotations/{shard:digits}-of-{shards:digits}/',
+  '/friendfeed/{nickname:word}/annotations/{shard:digits}-of-{shards:digits}'
+  '/{digest:word}/',
+  '/friendfeed/{nickname:word}/annotations[/{start_index:digits}]/',
+]
+
+
+def _app(environ, start_response):
+  return []
+
+
+def _start_response(status, headers, exc_info=None):
+  pass
+
+
+def dispatcher_benchmarks(routes):
+  """Routes to the first and last of routes templates, and to a 404."""
+  dispatcher = wsgidispatcher.Dispatcher(handle404=_app)
+  for i in xrange(routes):
+    dispatcher.add('/route%d/{nickname:word}/' % i, GET=_app)
+
+  def call(path):
+    environ = {'PATH_INFO': path, 'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': ''}
+    return lambda: dispatcher(dict(environ), _start_response)
+
+  name = 'dispatch %d routes' % routes
+  return [harness.Benchmark(name + ' first', call('/route0/dewitt/'), 10000),
+          harness.Benchmark(name + ' last',
+                            call('/route%d/dewitt/' % (routes - 1)), 1000),
+          harness.Benchmark(name + ' 404', call('/nowhere/'), 1000)]
+
+
+def template_response_benchmarks():
+  """Renders the cref and annotation templates, if they can be."""
+  try:
+    import wego
+  except ImportError:
+    print >> sys.stderr, 'Skipping TemplateResponse: wego is not importable.'
+    return []
+  cref = {'nickname': 'dewitt', 'name': 'DeWitt Clinton',
+          'shard_count': 32,
+          'shards': [{'index': i, 'digest': '%016x' % i} for i in range(32)]}
+  annotations = {'annotations': [
+    '<Annotation about="http://friendfeed.com/friend%d/*">'
+    '<Label name="include"/></Annotation>' % i for i in xrange(5)]}
+  return [
+    harness.Benchmark('TemplateResponse cref.tmpl',
+                      lambda: wego.TemplateResponse('cref.tmpl', cref), 200),
+    harness.Benchmark(
+      'TemplateResponse annotations.tmpl',
+      lambda: wego.TemplateResponse('annotations.tmpl', annotations), 200),
+  ]
+
+
+def benchmarks():
+  """Returns every micro-benchmark."""
+  result = []
+  for template in WEGO_TEMPLATES:
+    result.append(harness.Benchmark(
+      'template2regex %s' % template,
+      lambda template=template: wsgidispatcher.template2regex(template),
+      5000))
+
+  for routes in (10, 100):
+    result.extend(dispatcher_benchmarks(routes))
+
+  handler = bench_decorator.handler
+  caller = bench_decorator.call
+  decorated = decorator.decorator(caller)(handler)
+  result.extend([
+    harness.Benchmark('decorator undecorated call',
+                      lambda: caller(handler, '/friendfeed/a/', 'a'), 100000),
+    harness.Benchmark('decorator decorated call',
+                      lambda: decorated('/friendfeed/a/', 'a'), 100000),
+    harness.Benchmark('decorator decorate',
+                      lambda: decorator.decorator(caller)(handler), 2000),
+  ])
+
+  for count in (25, 250):
+    profile = bench_simplejson.profile(count)
+    profile_json = simplejson.dumps(profile)
+    nicknames = bench_simplejson.nickname_list(count)
+    result.extend([
+      harness.Benchmark('simplejson dumps profile (%d)' % count,
+                        lambda profile=profile: simplejson.dumps(profile),
+                        25000 / count),
+      harness.Benchmark('simplejson loads profile (%d)' % count,
+                        lambda data=profile_json: simplejson.loads(data),
+                        25000 / count),
+      harness.Benchmark('simplejson dumps nicknames (%d)' % count,
+                        lambda data=nicknames: simplejson.dumps(data),
+                        100000 / count),
+    ])
+
+  result.extend(template_response_benchmarks())
+  return result
+
+
+if __name__ == '__main__':
+  os.environ.setdefault('SERVER_SOFTWARE', 'Microbench/1.0')
+  sys.exit(harness.main(benchmarks(), sys.argv[1:]))
@@ -0,0 +1,69 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cache keys that memcache will always accept.
+
+Memcache refuses keys over 250 bytes, and plain memcache also refuses
+spaces and control characters.  make_key leaves keys that are short and
+plain alone, so that they stay readable in the cache, and replaces any
+other key with a readable prefix followed by the SHA-1 of the whole key:
+
+  >>> make_key('wego:get_url:http://friendfeed.com/a')
+  ('wego:get_url:http://friendfeed.com/a', False)
+  >>> key, hashed = make_key('wego:get_url:' + 'x' * 300)
+  >>> len(key), hashed
+  (221, True)
+  >>> make_key(u'wego:get_annotation:caf\\xe9')[0][:25]
+  'wego:get_annotation:caf__'
+
+A hashed key can in principle be shared by two different keys, so the
+caller should store the full key with the value and compare it when the
+value is read back.
+"""
+
+import re
+
+try:
+  from hashlib import sha1
+except ImportError:
+  from sha import new as sha1
+
+import backends
+import metrics
+
+# How much of a hashed key is kept readable, leaving room for the hash.
+READABLE_PREFIX = 180
+
+_UNSAFE = re.compile(r'[^\x21-\x7e]')
+
+HASHED_KEYS = metrics.Counter(
+  'cache_keys_hashed', 'Cache keys that were too long or unsafe to use as is.')
+
+
+def make_key(key):
+  """Returns a (key, hashed) pair, where key is safe to use in memcache.
+
+  Args:
+    key: A str or unicode key of any length.
+  Returns:
+    The key itself if it is safe, otherwise a bounded key derived from
+    it, and whether the key was hashed.
+  """
+  if isinstance(key, unicode):
+    key = key.encode('utf-8')
+  if len(key) <= backends.MAX_KEY_SIZE and not _UNSAFE.search(key):
+    return key, False
+  HASHED_KEYS.inc()
+  readable = _UNSAFE.sub('_', key[:READABLE_PREFIX])
+  return '%s:%s' % (readable, sha1(key).hexdigest()), True
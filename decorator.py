@@ -6,7 +6,7 @@ for the documentation and below for the licence.
 
 ## The basic trick is to generate the source code for the decorated function
 ## with the right signature and to evaluate it.
-## Uncomment the statement 'print >> sys.stderr, func_src'  in _decorator
+## Uncomment the statement 'print >> sys.stderr, src'  in _wrapper_factory
 ## to understand what is going on.
 
 __all__ = ["decorator", "new_wrapper", "getinfo"]
@@ -58,6 +58,41 @@ def getinfo(func):
                 module=func.__module__, dict=func.__dict__,
                 globals=func.func_globals, closure=func.func_closure)
 
+# Wrapper factories, keyed by (signature, call expression).  Compiling the
+# generated source is by far the most expensive part of decorating a
+# function, and most functions in an application share a handful of
+# signatures, so each one is compiled only once.  A factory takes the free
+# variables of the call expression and returns a closure over them, so
+# the compiled code can be shared; calling the closure costs the same as
+# calling a lambda that looks them up as globals.
+_factories = {}
+
+def _wrapper_factory(signature, call, freevars):
+    """
+    Returns a function that takes ``freevars`` and returns a closure with
+    the given signature whose body is ``return <call>``.
+
+    >>> make = _wrapper_factory('x, y', '_f_(y, x)', '_f_')
+    >>> make(lambda a, b: a - b)(1, 3)
+    2
+    >>> make is _wrapper_factory('x, y', '_f_(y, x)', '_f_')
+    True
+    """
+    key = (signature, call)
+    try:
+        return _factories[key]
+    except KeyError:
+        pass
+    src = ("def _factory_(%s):\n"
+           "    def _closure_(%s):\n"
+           "        return %s\n"
+           "    return _closure_\n" % (freevars, signature, call))
+    # print >> sys.stderr, src # for debugging purposes
+    namespace = {}
+    exec src in namespace
+    factory = _factories[key] = namespace['_factory_']
+    return factory
+
 # akin to functools.update_wrapper
 def update_wrapper(wrapper, model, infodict=None):
     infodict = infodict or getinfo(model)
@@ -86,9 +121,10 @@ def new_wrapper(wrapper, model):
         infodict = getinfo(model)
     assert not '_wrapper_' in infodict["argnames"], (
         '"_wrapper_" is a reserved argument name!')
-    src = "lambda %(signature)s: _wrapper_(%(signature)s)" % infodict
-    funcopy = eval(src, dict(_wrapper_=wrapper))
-    return update_wrapper(funcopy, model, infodict)
+    signature = infodict["signature"]
+    make = _wrapper_factory(signature, "_wrapper_(%s)" % signature,
+                            "_wrapper_")
+    return update_wrapper(make(wrapper), model, infodict)
 
 # helper used in decorator_factory
 def __call__(self, func):
@@ -96,9 +132,11 @@ def __call__(self, func):
     for name in ('_func_', '_self_'):
         assert not name in infodict["argnames"], (
            '%s is a reserved argument name!' % name)
-    src = "lambda %(signature)s: _self_.call(_func_, %(signature)s)"
-    new = eval(src % infodict, dict(_func_=func, _self_=self))
-    return update_wrapper(new, func, infodict)
+    signature = infodict["signature"]
+    make = _wrapper_factory(signature,
+                            "_self_.call(_func_, %s)" % signature,
+                            "_self_, _func_")
+    return update_wrapper(make(self, func), func, infodict)
 
 def decorator_factory(cls):
     """
@@ -154,10 +192,11 @@ def decorator(caller):
         argnames = infodict['argnames']
         assert not ('_call_' in argnames or '_func_' in argnames), (
             'You cannot use _call_ or _func_ as argument names!')
-        src = "lambda %(signature)s: _call_(_func_, %(signature)s)" % infodict
-        # import sys; print >> sys.stderr, src # for debugging purposes
-        dec_func = eval(src, dict(_func_=func, _call_=caller))
-        return update_wrapper(dec_func, func, infodict)
+        signature = infodict['signature']
+        make = _wrapper_factory(signature,
+                                "_call_(_func_, %s)" % signature,
+                                "_call_, _func_")
+        return update_wrapper(make(caller, func), func, infodict)
     return update_wrapper(_decorator, caller)
 
 if __name__ == "__main__":
@@ -0,0 +1,188 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Counters, histograms and gauges for the metrics endpoint.
+
+Metrics are declared once, at module level, with the names of their
+labels, and updated with a tuple of label values:
+
+  >>> requests = Counter('example_requests', 'Requests served.',
+  ...                    ('route', 'status'))
+  >>> requests.inc(('/faq/', '200'))
+  >>> requests.inc(('/faq/', '200'))
+  >>> print prometheus_text().strip()
+  # HELP wego_example_requests Requests served.
+  # TYPE wego_example_requests counter
+  wego_example_requests{route="/faq/",status="200"} 2
+  >>> unregister(requests)
+
+Updates are a dict lookup and an addition, with no locking, so they are
+cheap enough to leave on everywhere.  Under threads a concurrent update
+may rarely be lost, which is an acceptable price for monitoring.
+Gauges are computed by a function only when the metrics are read.
+"""
+
+import timing
+
+PREFIX = 'wego_'
+
+registry = []
+
+
+class Metric(object):
+  """Base class for metrics, which register themselves when created."""
+
+  kind = None
+
+  def __init__(self, name, help, labelnames=()):
+    self.name = name
+    self.help = help
+    self.labelnames = tuple(labelnames)
+    registry.append(self)
+
+  def samples(self):
+    """Returns a list of (labels, value) pairs."""
+    raise NotImplementedError
+
+
+class Counter(Metric):
+  """A count that only goes up."""
+
+  kind = 'counter'
+
+  def __init__(self, name, help, labelnames=()):
+    super(Counter, self).__init__(name, help, labelnames)
+    self._values = {}
+
+  def inc(self, labels=(), value=1):
+    self._values[labels] = self._values.get(labels, 0) + value
+
+  def get(self, labels=()):
+    return self._values.get(labels, 0)
+
+  def samples(self):
+    return sorted(self._values.items())
+
+
+class Histogram(Metric):
+  """A distribution of durations in milliseconds."""
+
+  kind = 'histogram'
+
+  def __init__(self, name, help, labelnames=()):
+    super(Histogram, self).__init__(name, help, labelnames)
+    self._values = {}
+
+  def observe(self, labels, ms):
+    histogram = self._values.get(labels)
+    if histogram is None:
+      histogram = self._values[labels] = timing.Histogram()
+    histogram.add(ms)
+
+  def samples(self):
+    return sorted(self._values.items())
+
+
+class Gauge(Metric):
+  """A value computed when read, by a function returning either a number
+  or a dict of label tuples to numbers."""
+
+  kind = 'gauge'
+
+  def __init__(self, name, help, func, labelnames=()):
+    super(Gauge, self).__init__(name, help, labelnames)
+    self._func = func
+
+  def samples(self):
+    try:
+      value = self._func()
+    except Exception:
+      # A broken gauge must not take the rest of the metrics with it.
+      return []
+    if isinstance(value, dict):
+      return sorted(value.items())
+    return [((), value)]
+
+
+def unregister(metric):
+  """Removes a metric from the registry."""
+  registry.remove(metric)
+
+
+def reset():
+  """Zeroes every counter and histogram."""
+  for metric in registry:
+    if hasattr(metric, '_values'):
+      metric._values.clear()
+
+
+def _label_text(labelnames, labels, extra=()):
+  pairs = zip(labelnames, labels) + list(extra)
+  if not pairs:
+    return ''
+  return '{%s}' % ','.join([
+    '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                 .replace('"', '\\"').replace('\n', '\\n'))
+    for name, value in pairs])
+
+
+def _number(value):
+  if value == float('inf'):
+    return '+Inf'
+  if isinstance(value, float):
+    return repr(value)
+  return str(value)
+
+
+def prometheus_text():
+  """Returns every metric in the Prometheus text exposition format."""
+  lines = []
+  for metric in registry:
+    name = PREFIX + metric.name
+    lines.append('# HELP %s %s' % (name, metric.help))
+    lines.append('# TYPE %s %s' % (name, metric.kind))
+    for labels, value in metric.samples():
+      if metric.kind != 'histogram':
+        lines.append('%s%s %s' % (
+          name, _label_text(metric.labelnames, labels), _number(value)))
+        continue
+      cumulative = 0
+      for bound, count in zip(timing.BUCKETS + (float('inf'),), value.counts):
+        cumulative += count
+        lines.append('%s_bucket%s %d' % (
+          name,
+          _label_text(metric.labelnames, labels, [('le', _number(bound))]),
+          cumulative))
+      label_text = _label_text(metric.labelnames, labels)
+      lines.append('%s_sum%s %s' % (name, label_text, repr(value.total_ms)))
+      lines.append('%s_count%s %d' % (name, label_text, value.count))
+  return '\n'.join(lines) + '\n'
+
+
+def snapshot():
+  """Returns every metric as a list of plain dicts, for JSON and HTML."""
+  result = []
+  for metric in registry:
+    samples = []
+    for labels, value in metric.samples():
+      if metric.kind == 'histogram':
+        value = value.summary()
+      samples.append({'labels': dict(zip(metric.labelnames, labels)),
+                      'label_text': ', '.join([
+                        '%s=%s' % pair
+                        for pair in zip(metric.labelnames, labels)]),
+                      'value': value})
+    result.append({'name': metric.name, 'help': metric.help,
+                   'kind': metric.kind, 'samples': samples})
+  return result
@@ -0,0 +1,165 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Version counters that let cached results be invalidated selectively.
+
+Every cached result is keyed by three versions: one for the whole app,
+one for the function that computed it and, for results about a user,
+one for that user's nickname.  Bumping a version makes every key built
+from it unreachable, so the old entries are never read again and simply
+expire, and nothing needs to be flushed:
+
+  >>> import backends, upstream
+  >>> clock = upstream.FakeClock(1000)
+  >>> cache = backends.LocalCache(clock=clock)
+  >>> versions = Versions(clock=clock)
+  >>> versions.tag(cache, 'get_url', 'dewitt')
+  '1000.1000.1000'
+  >>> versions.bump(cache, nickname='dewitt')
+  1001
+  >>> versions.tag(cache, 'get_url', 'dewitt')
+  '1000.1000.1001'
+  >>> versions.tag(cache, 'get_url', 'bob')
+  '1000.1000.1000'
+
+Versions start at the time they were first needed rather than at zero,
+so that a counter evicted from the cache comes back with a value that
+was never used before, instead of reviving entries it had invalidated.
+
+The versions a request uses are read once per request, so that a
+request sees one consistent set of versions however many cached
+functions it calls.  A request about to look up the results of many
+users reads all of their versions first, with a single get_multi:
+
+  >>> versions.start_request()
+  >>> versions.preload(cache, 'get_annotation', ['al', 'bob', 'carol'])
+  >>> versions.tag(cache, 'get_annotation', 'carol')
+  '1000.1000.1000'
+  >>> versions.end_request()
+
+Counters for nicknames too long for a memcache key are kept under a
+hashed key, and last like any other:
+
+  >>> long_nickname = 'x' * 241
+  >>> versions.tag(cache, 'get_url', long_nickname)
+  '1000.1000.1000'
+  >>> clock.now += 60
+  >>> versions.tag(cache, 'get_url', long_nickname)
+  '1000.1000.1000'
+"""
+
+import threading
+import time
+
+import cachekeys
+
+KEY_PREFIX = 'version:'
+GLOBAL = KEY_PREFIX + 'global'
+
+
+def _key(kind, name):
+  """Returns the cache key of a version counter.
+
+  The prefix is part of the key that is hashed, so that the key is short
+  enough for memcache however long the name:
+
+    >>> len(_key('nickname', 'x' * 233)), len(_key('nickname', 'x' * 234))
+    (250, 221)
+  """
+  return cachekeys.make_key('%s%s:%s' % (KEY_PREFIX, kind, name))[0]
+
+
+def _keys(function, nickname):
+  keys = [GLOBAL, _key('function', function)]
+  if nickname:
+    keys.append(_key('nickname', nickname.lower()))
+  return keys
+
+
+class Versions(object):
+  """Reads and bumps the version counters kept in a cache."""
+
+  def __init__(self, clock=time.time):
+    self._clock = clock
+    self._local = threading.local()
+
+  def start_request(self):
+    """Remembers the versions read from now until end_request."""
+    self._local.versions = {}
+
+  def end_request(self):
+    self._local.versions = None
+
+  def tag(self, cache, function, nickname=None):
+    """Returns the versions for a result as a string for its key."""
+    keys = _keys(function, nickname)
+    known = getattr(self._local, 'versions', None)
+    if known is None:
+      known = {}
+    self._read(cache, keys, known)
+    return '.'.join([str(known[key]) for key in keys])
+
+  def preload(self, cache, function, nicknames):
+    """Reads, together, the versions for the results of function about
+    each of nicknames, for the tags that follow in this request."""
+    known = getattr(self._local, 'versions', None)
+    if known is None:
+      return
+    keys = {}
+    for nickname in nicknames:
+      for key in _keys(function, nickname):
+        keys[key] = True
+    self._read(cache, keys.keys(), known)
+
+  def _read(self, cache, keys, known):
+    """Adds the versions of keys that are not in known to it."""
+    missing = [key for key in keys if key not in known]
+    if missing:
+      found = cache.get_multi(missing)
+      for key in missing:
+        version = found.get(key)
+        if version is None:
+          version = self._seed(cache, key)
+        known[key] = version
+
+  def _seed(self, cache, key):
+    version = int(self._clock())
+    if not cache.add(key, version):
+      # Another request seeded or bumped it first.
+      version = cache.get(key) or version
+    return version
+
+  def bump(self, cache, function=None, nickname=None):
+    """Invalidates one user's results, one function's, or everything.
+
+    Args:
+      cache: The cache holding the versions.
+      function: The name of a cacheable function.
+      nickname: A user's nickname.
+    If neither is given, every cached result is invalidated.
+    Returns:
+      The new version, or None if the cache could not be updated.
+    """
+    if nickname:
+      key = _key('nickname', nickname.lower())
+    elif function:
+      key = _key('function', function)
+    else:
+      key = GLOBAL
+    version = cache.incr(key,
+                         initial_value=int(self._clock()))
+    known = getattr(self._local, 'versions', None)
+    if known is not None:
+      known.pop(key, None)
+    return version
@@ -0,0 +1,140 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in profiling of a sample of production requests.
+
+A request is profiled if it is the rate'th request seen by its instance,
+or if it carries the profiling token in an X-Wego-Profile header or a
+__profile query parameter.  Both rate and token are off until set, and
+are stored in the cache so that every instance picks them up within
+REFRESH_INTERVAL seconds.
+
+Each profiled request's stats are merged into an aggregate that is also
+kept in the cache, so the report covers every instance:
+
+  >>> cache = backends.LocalCache()
+  >>> profiler = Profiler()
+  >>> profiler.configure(cache, rate=2)
+  >>> [profiler.wants({}, cache) for i in range(4)]
+  [False, True, False, True]
+  >>> profiler.runcall(cache, sorted, [3, 1, 2])
+  [1, 2, 3]
+  >>> 'sorted' in profiler.report(cache)
+  True
+"""
+
+import marshal
+import pstats
+import StringIO
+import time
+
+try:
+  import cProfile as profile
+except ImportError:
+  import profile
+
+import backends
+
+CONFIG_KEY = 'profiler:config'
+STATS_KEY = 'profiler:stats'
+REFRESH_INTERVAL = 10
+HEADER = 'HTTP_X_WEGO_PROFILE'
+QUERY_PARAMETER = '__profile'
+
+
+class _LoadedStats(object):
+  """Lets pstats.Stats load a stats dict that was kept in the cache."""
+
+  def __init__(self, stats):
+    self.stats = stats
+
+  def create_stats(self):
+    pass
+
+
+class Profiler(object):
+  """Decides which requests to profile and aggregates their stats."""
+
+  def __init__(self):
+    self.rate = 0
+    self.token = None
+    self._seen = 0
+    self._next_refresh = 0
+
+  def refresh(self, cache, now=None):
+    """Rereads the configuration if REFRESH_INTERVAL has passed."""
+    if now is None:
+      now = time.time()
+    if now < self._next_refresh:
+      return
+    self._next_refresh = now + REFRESH_INTERVAL
+    self.rate, self.token = cache.get(CONFIG_KEY) or (0, None)
+
+  def configure(self, cache, rate=0, token=None):
+    """Profiles 1 in rate requests, and requests carrying token, on every
+    instance.  A rate of 0 and an empty token turn profiling off."""
+    self.rate, self.token = int(rate or 0), token or None
+    cache.set(CONFIG_KEY, (self.rate, self.token))
+    self._next_refresh = time.time() + REFRESH_INTERVAL
+
+  def wants(self, environ, cache):
+    """Returns True if the request in environ should be profiled."""
+    self.refresh(cache)
+    if self.token:
+      if environ.get(HEADER) == self.token:
+        return True
+      query = environ.get('QUERY_STRING', '')
+      if query and '%s=%s' % (QUERY_PARAMETER, self.token) in query:
+        return True
+    if self.rate:
+      self._seen += 1
+      return self._seen % self.rate == 0
+    return False
+
+  def runcall(self, cache, func, *args, **kwargs):
+    """Calls func under the profiler and merges its stats."""
+    profiler = profile.Profile()
+    try:
+      return profiler.runcall(func, *args, **kwargs)
+    finally:
+      self._merge(cache, profiler)
+
+  def _merge(self, cache, profiler):
+    stats = pstats.Stats(profiler)
+    requests = 1
+    saved = cache.get(STATS_KEY)
+    if saved:
+      requests += saved[0]
+      stats.add(_LoadedStats(marshal.loads(saved[1])))
+    data = marshal.dumps(stats.stats)
+    if len(data) < backends.MAX_VALUE_SIZE:
+      cache.set(STATS_KEY, (requests, data))
+
+  def report(self, cache, sort='cumulative', limit=60):
+    """Returns the aggregated stats as text, sorted by the given key."""
+    saved = cache.get(STATS_KEY)
+    if not saved:
+      return 'No requests have been profiled.\n'
+    output = StringIO.StringIO()
+    stats = pstats.Stats(_LoadedStats(marshal.loads(saved[1])), stream=output)
+    print >> output, '%d profiled requests' % saved[0]
+    stats.sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+  def reset(self, cache):
+    """Discards the aggregated stats."""
+    cache.delete(STATS_KEY)
+
+
+sampler = Profiler()
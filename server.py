@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Serves wego outside App Engine from several worker processes.
+
+The parent imports wego, which builds the dispatcher, loads what wego
+defers to first use and opens the listening socket, then forks one
+worker per core.  The workers inherit all of it and accept connections
+from the same socket, so every worker starts warm and requests are
+spread over the cores.
+
+Each worker has its own in-process cache unless the workers are pointed
+at memcached, which they then share:
+
+  python server.py --port 8080 --memcached 127.0.0.1:11211
+
+SIGTERM or SIGINT stops the server gracefully: each worker finishes the
+request it is handling and exits, and workers that have not exited
+after GRACE_SECONDS are killed.  Workers that die on their own are
+replaced.  Metrics, timing and profiles are kept per worker.
+
+--sdk adds the App Engine SDK and its bundled webob and django to the
+path; it may be left out if they are importable already.
+"""
+
+import errno
+import logging
+import optparse
+import os
+import signal
+import sys
+import time
+
+# How often an idle worker checks whether it should stop, in seconds.
+POLL_INTERVAL = 0.5
+GRACE_SECONDS = 10
+
+
+def add_sdk_to_path(sdk):
+  """Puts the App Engine SDK and its bundled libraries on sys.path."""
+  sdk = os.path.abspath(os.path.expanduser(sdk))
+  sys.path.insert(0, sdk)
+  lib = os.path.join(sdk, 'lib')
+  if os.path.isdir(lib):
+    for name in sorted(os.listdir(lib)):
+      sys.path.insert(0, os.path.join(lib, name))
+
+
+def cpu_count():
+  """Returns the number of cores, or 1 if it cannot be found."""
+  try:
+    return max(1, int(os.sysconf('SC_NPROCESSORS_ONLN')))
+  except (AttributeError, ValueError, OSError):
+    return 1
+
+
+def make_server(host, port, app):
+  """Returns a wsgiref server for app, listening on host and port."""
+  from wsgiref import simple_server
+
+  class Handler(simple_server.WSGIRequestHandler):
+    def log_message(self, format, *args):
+      logging.debug('%s %s', self.client_address[0], format % args)
+
+  server = simple_server.make_server(host, port, app,
+                                     handler_class=Handler)
+  server.timeout = POLL_INTERVAL
+  return server
+
+
+class Stopper(object):
+  """A signal handler that remembers that the process should stop."""
+
+  def __init__(self):
+    self.stopping = False
+
+  def __call__(self, signum, frame):
+    self.stopping = True
+
+  def install(self, restart=False):
+    """Installs the handler.  If restart is True, system calls that the
+    signal interrupts are restarted rather than failing."""
+    for signum in (signal.SIGTERM, signal.SIGINT):
+      signal.signal(signum, self)
+      if restart and hasattr(signal, 'siginterrupt'):
+        signal.siginterrupt(signum, False)
+
+
+def serve(server):
+  """Handles requests in a worker until it is told to stop."""
+  import backends
+  import wego
+  # Connections must not be shared with the parent or other workers.
+  wego.cache, wego.fetcher = backends.default_backends()
+  wego.store = backends.BufferedStore(backends.default_store())
+  stopper = Stopper()
+  # Let the request being handled finish its reads and writes.
+  stopper.install(restart=True)
+  while not stopper.stopping:
+    server.handle_request()
+  server.server_close()
+
+
+def spawn(server):
+  """Forks a worker serving from server.  Returns its pid."""
+  pid = os.fork()
+  if pid:
+    return pid
+  status = 0
+  try:
+    try:
+      serve(server)
+    except Exception:
+      logging.exception('Worker %d failed', os.getpid())
+      status = 1
+  finally:
+    os._exit(status)
+
+
+def supervise(server, workers):
+  """Runs that many worker processes until told to stop, replacing any
+  that die, then stops them."""
+  stopper = Stopper()
+  stopper.install()
+  pids = set()
+  for i in xrange(workers):
+    pids.add(spawn(server))
+  while not stopper.stopping:
+    try:
+      pid, status = os.wait()
+    except OSError, e:
+      if e.errno == errno.EINTR:
+        continue
+      raise
+    pids.discard(pid)
+    if not stopper.stopping:
+      logging.warning('Worker %d exited with %d; replacing it', pid, status)
+      pids.add(spawn(server))
+  logging.info('Stopping %d workers', len(pids))
+  for pid in pids:
+    _kill(pid, signal.SIGTERM)
+  give_up_at = time.time() + GRACE_SECONDS
+  while pids and time.time() < give_up_at:
+    for pid in list(pids):
+      if _reap(pid):
+        pids.discard(pid)
+    time.sleep(0.1)
+  for pid in pids:
+    logging.warning('Killing worker %d', pid)
+    _kill(pid, signal.SIGKILL)
+    _reap(pid, 0)
+  server.server_close()
+
+
+def _kill(pid, signum):
+  try:
+    os.kill(pid, signum)
+  except OSError:
+    pass
+
+
+def _reap(pid, options=os.WNOHANG):
+  """Returns True if worker pid has exited."""
+  try:
+    return os.waitpid(pid, options)[0] == pid
+  except OSError:
+    return True
+
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--host', default='127.0.0.1',
+                    help='address to listen on [%default]')
+  parser.add_option('--port', type='int', default=8080,
+                    help='port to listen on [%default]')
+  parser.add_option('--workers', type='int', default=cpu_count(),
+                    help='worker processes to fork [%default]')
+  parser.add_option('--memcached', metavar='HOST:PORT,...',
+                    help='memcached servers for the workers to share')
+  parser.add_option('--sdk', help='path to the App Engine SDK')
+  parser.add_option('--verbose', action='store_true',
+                    help='log every request')
+  options, args = parser.parse_args(argv[1:])
+  logging.basicConfig(level=options.verbose and logging.DEBUG or
+                      logging.INFO)
+  if options.sdk:
+    add_sdk_to_path(options.sdk)
+  if options.memcached:
+    os.environ['WEGO_MEMCACHED'] = options.memcached
+  elif options.workers > 1:
+    logging.warning('Without --memcached, each worker has its own cache')
+
+  # Everything done once for all workers happens here, before the fork.
+  # Each worker opens its own store, so the parent leaves it closed.
+  import wego
+  wego.prepare_instance(skip=('store',))
+  server = make_server(options.host, options.port, wego.dispatcher.get_app())
+  logging.info('Serving on http://%s:%d/ with %d workers',
+               options.host, server.server_port, options.workers)
+  supervise(server, options.workers)
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,104 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Splits a user's friends into annotation shards.
+
+A friend's shard is a hash of their nickname modulo the number of
+shards, so it does not depend on where they are in the subscription
+list; adding or removing a friend changes only the shard they are in:
+
+  >>> friends = ['friend%d' % i for i in range(10)]
+  >>> before = partition(friends, 4)
+  >>> after = partition(friends + ['newcomer'], 4)
+  >>> [a == b for a, b in zip(before, after)].count(False)
+  1
+
+The number of shards is the smallest power of two that keeps shards
+under MAX_SHARD_BYTES, given the average size of an annotation, up to
+MAX_SHARDS.  Users with more friends than that fit get bigger shards,
+rather than losing friends:
+
+  >>> shard_count(5, 2000), shard_count(500, 2000), shard_count(10 ** 6, 2000)
+  (1, 16, 32)
+
+Because the count is a power of two, when it doubles every shard splits
+in two and no friend moves between the other shards.
+
+A shard's digest names its rendered contents, so a URL that includes it
+always refers to the same bytes:
+
+  >>> digest('<Annotations></Annotations>')
+  '9ed5ab1a2f2e2a75'
+"""
+
+import threading
+
+try:
+  from hashlib import md5
+except ImportError:
+  from md5 import new as md5
+
+# Custom Search allows 50 annotation includes per engine.
+MAX_SHARDS = 32
+MAX_SHARD_BYTES = 64 * 1024
+DEFAULT_ANNOTATION_BYTES = 2000
+
+
+def shard_of(nickname, shards):
+  """Returns the shard, from 0 to shards - 1, that nickname belongs to."""
+  if isinstance(nickname, unicode):
+    nickname = nickname.encode('utf-8')
+  return int(md5(nickname).hexdigest()[:8], 16) % shards
+
+
+def shard_count(friends, annotation_bytes, max_bytes=MAX_SHARD_BYTES,
+                max_shards=MAX_SHARDS):
+  """Returns how many shards to split the annotations of friends into."""
+  shards = 1
+  total_bytes = friends * annotation_bytes
+  while shards < max_shards and total_bytes > shards * max_bytes:
+    shards *= 2
+  return shards
+
+
+def partition(friends, shards):
+  """Returns a list of the friends in each shard, in their given order."""
+  result = [[] for i in xrange(shards)]
+  for friend in friends:
+    result[shard_of(friend, shards)].append(friend)
+  return result
+
+
+def digest(content):
+  """Returns a short hash of a shard's rendered contents."""
+  return md5(content).hexdigest()[:16]
+
+
+class SizeEstimate(object):
+  """A running average of annotation sizes, in bytes."""
+
+  def __init__(self, default=DEFAULT_ANNOTATION_BYTES, weight=0.05):
+    self.average = float(default)
+    # The number of sizes added, rather than assumed.
+    self.count = 0
+    self._weight = weight
+    self._lock = threading.Lock()
+
+  def add(self, size):
+    self._lock.acquire()
+    try:
+      self.average += (size - self.average) * self._weight
+      self.count += 1
+    finally:
+      self._lock.release()
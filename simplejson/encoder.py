@@ -40,6 +40,10 @@ def encode_basestring(s):
 
 
 def py_encode_basestring_ascii(s):
+    # Fast path: most strings (nicknames, urls) are plain ASCII with
+    # nothing to escape, so skip the decode and the substitution entirely.
+    if ESCAPE_ASCII.search(s) is None:
+        return '"' + str(s) + '"'
     if isinstance(s, str) and HAS_UTF8.search(s) is not None:
         s = s.decode('utf-8')
     def replace(match):
@@ -267,12 +271,57 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr, _key_separ
         long=long,
         str=str,
         tuple=tuple,
+        _scalar_types=(basestring, int, long, float),
     ):
 
+    def _encode_flat_list(lst):
+        # A list made only of strings (e.g. a list of nicknames) cannot
+        # nest or refer to itself, so it can be encoded in a single join
+        # without the per-element generator machinery.
+        for value in lst:
+            if not isinstance(value, basestring):
+                return None
+        return '[' + _item_separator.join([_encoder(value) for value in lst]) + ']'
+
+    def _encode_flat_dict(dct):
+        # Likewise for a dict of strings to scalars, which covers most of
+        # the objects found in a profile.
+        for key, value in dct.iteritems():
+            if not isinstance(key, basestring):
+                return None
+            if value is not None and not isinstance(value, _scalar_types):
+                return None
+        if _sort_keys:
+            items = dct.items()
+            items.sort(key=lambda kv: kv[0])
+        else:
+            items = dct.iteritems()
+        chunks = []
+        for key, value in items:
+            if isinstance(value, basestring):
+                value = _encoder(value)
+            elif value is None:
+                value = 'null'
+            elif value is True:
+                value = 'true'
+            elif value is False:
+                value = 'false'
+            elif isinstance(value, (int, long)):
+                value = str(value)
+            else:
+                value = _floatstr(value)
+            chunks.append(_encoder(key) + _key_separator + value)
+        return '{' + _item_separator.join(chunks) + '}'
+
     def _iterencode_list(lst, _current_indent_level):
         if not lst:
             yield '[]'
             return
+        if _indent is None:
+            flat = _encode_flat_list(lst)
+            if flat is not None:
+                yield flat
+                return
         if markers is not None:
             markerid = id(lst)
             if markerid in markers:
@@ -326,6 +375,11 @@ def _make_iterencode(markers, _default, _encoder, _indent, _floatstr, _key_separ
         if not dct:
             yield '{}'
             return
+        if _indent is None:
+            flat = _encode_flat_dict(dct)
+            if flat is not None:
+                yield flat
+                return
         if markers is not None:
             markerid = id(dct)
             if markerid in markers:
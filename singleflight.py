@@ -0,0 +1,156 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Makes concurrent computations of the same result share one call.
+
+Within an instance, Group.do runs func once per key at a time; threads
+that ask for the same key while it runs wait and share its outcome:
+
+  >>> group = Group()
+  >>> group.do('friend:bob', lambda: 'annotations')
+  ('annotations', False)
+
+Across instances, a lease is a cache entry that one instance adds before
+computing a result.  Instances that fail to add it poll the cache for a
+while for the leaseholder's result instead of computing it themselves:
+
+  >>> import backends
+  >>> cache = backends.LocalCache()
+  >>> acquire(cache, 'friend:bob')
+  True
+  >>> acquire(cache, 'friend:bob')
+  False
+  >>> release(cache, 'friend:bob')
+  >>> wait(lambda: 'stored', timeout=1)
+  'stored'
+
+An add can also fail because the cache is failing, so before waiting, an
+instance checks that the lease is actually held, and computes the result
+itself if it is not:
+
+  >>> class FailingCache(backends.LocalCache):
+  ...   def add(self, key, value, time=0):
+  ...     return False
+  >>> failing = FailingCache()
+  >>> acquire(failing, 'friend:carol'), held(failing, 'friend:carol')
+  (False, False)
+  >>> acquire(cache, 'friend:carol'), held(cache, 'friend:carol')
+  (True, True)
+
+Leases on keys that are already as long as memcache allows are taken
+under a hashed key:
+
+  >>> acquire(cache, 'x' * 250), acquire(cache, 'x' * 250)
+  (True, False)
+"""
+
+import threading
+import time
+
+import cachekeys
+
+LEASE_PREFIX = 'lease:'
+LEASE_SECONDS = 10
+WAIT_INTERVAL = 0.05
+
+
+class _Call(object):
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+
+
+class Group(object):
+  """Deduplicates concurrent calls by key within this process."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._calls = {}
+
+  def do(self, key, func):
+    """Calls func, unless a call for key is already running.
+
+    Returns:
+      A (result, shared) pair, where shared is True if the result came
+      from another thread's call.
+    Raises:
+      Whatever func raised, in every thread that waited for it.
+    """
+    self._lock.acquire()
+    try:
+      call = self._calls.get(key)
+      leader = call is None
+      if leader:
+        call = self._calls[key] = _Call()
+    finally:
+      self._lock.release()
+    if not leader:
+      call.done.wait()
+      if call.error is not None:
+        raise call.error
+      return call.result, True
+    try:
+      try:
+        call.result = func()
+      except Exception, e:
+        call.error = e
+        raise
+    finally:
+      self._lock.acquire()
+      try:
+        del self._calls[key]
+      finally:
+        self._lock.release()
+      call.done.set()
+    return call.result, False
+
+  def in_flight(self):
+    """Returns the number of keys being computed."""
+    return len(self._calls)
+
+
+def acquire(cache, key, seconds=LEASE_SECONDS):
+  """Takes the lease on key for seconds.  Returns True if it was free."""
+  return cache.add(_lease_key(key), 1, seconds)
+
+
+def held(cache, key):
+  """Returns True if some instance holds the lease on key."""
+  return cache.get(_lease_key(key)) is not None
+
+
+def release(cache, key):
+  """Gives up the lease on key."""
+  cache.delete(_lease_key(key))
+
+
+def _lease_key(key):
+  return cachekeys.make_key(LEASE_PREFIX + key)[0]
+
+
+def wait(poll, timeout, interval=WAIT_INTERVAL, sleep=time.sleep,
+         clock=time.time):
+  """Calls poll until it returns something other than None.
+
+  Returns:
+    What poll returned, or None if timeout seconds passed first.
+  """
+  give_up_at = clock() + timeout
+  while True:
+    result = poll()
+    if result is not None or clock() >= give_up_at:
+      return result
+    sleep(interval)
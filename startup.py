@@ -0,0 +1,161 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures what an instance does when it starts, and defers the rest.
+
+A Startup times the phases of loading the application, each ending
+with a call to mark, and warns if together they take longer than the
+budget:
+
+  >>> import upstream
+  >>> clock = upstream.FakeClock(100.0)
+  >>> loading = Startup(budget_ms=50, clock=clock)
+  >>> clock.now += 0.030
+  >>> loading.mark('imports')
+  >>> clock.now += 0.005
+  >>> loading.mark('init')
+  >>> loading.over_budget()
+  False
+
+Work that most requests do not need, such as importing a template
+engine or connecting to a store, is wrapped in a Lazy, which does it
+on first use and reports how long it took:
+
+  >>> json = loading.lazy_import('simplejson')
+  >>> json.dumps([1])
+  '[1]'
+  >>> [name for name, ms, at in loading.deferred]
+  ['simplejson']
+"""
+
+import logging
+import sys
+import threading
+import time
+
+# What loading the application may take before it is logged as slow.
+BUDGET_MS = 100
+
+
+class Lazy(object):
+  """Stands in for the result of factory until an attribute is needed.
+
+  The first attribute access calls factory, once, and every access is
+  then passed on to its result.
+  """
+
+  def __init__(self, startup, name, factory):
+    self.__dict__['_startup'] = startup
+    self.__dict__['_name'] = name
+    self.__dict__['_factory'] = factory
+    self.__dict__['_target'] = None
+    self.__dict__['_lock'] = threading.Lock()
+
+  def _resolve(self):
+    target = self._target
+    if target is None:
+      self._lock.acquire()
+      try:
+        target = self._target
+        if target is None:
+          start = self._startup.clock()
+          target = self._factory()
+          self._startup.record(self._name, start)
+          self.__dict__['_target'] = target
+      finally:
+        self._lock.release()
+    return target
+
+  def __getattr__(self, name):
+    return getattr(self._resolve(), name)
+
+  def __setattr__(self, name, value):
+    setattr(self._resolve(), name, value)
+
+  def __repr__(self):
+    if self._target is None:
+      return '<lazy %s>' % self._name
+    return repr(self._target)
+
+
+class Startup(object):
+  """The phases of starting an instance, and the work it deferred."""
+
+  def __init__(self, budget_ms=BUDGET_MS, clock=time.time):
+    self.budget_ms = budget_ms
+    self.clock = clock
+    self.started = self._last = clock()
+    # (name, ms) pairs, in order.
+    self.phases = []
+    # (name, ms, seconds after the start) of each Lazy as it was needed.
+    self.deferred = []
+    self._lazies = []
+
+  def mark(self, phase):
+    """Ends phase, which began when the previous one ended."""
+    now = self.clock()
+    self.phases.append((phase, (now - self._last) * 1000.0))
+    self._last = now
+
+  def record(self, name, start):
+    """Records deferred work called name that began at start."""
+    now = self.clock()
+    self.deferred.append((name, (now - start) * 1000.0, now - self.started))
+
+  def total_ms(self):
+    """Returns the time taken by the phases so far."""
+    return sum([ms for phase, ms in self.phases])
+
+  def over_budget(self):
+    return self.total_ms() > self.budget_ms
+
+  def check(self):
+    """Logs the phases, as a warning if they went over the budget."""
+    summary = ', '.join(['%s %.1fms' % phase for phase in self.phases])
+    if self.over_budget():
+      logging.warning('Startup took %.1fms, over the %dms budget: %s',
+                      self.total_ms(), self.budget_ms, summary)
+    else:
+      logging.debug('Startup took %.1fms: %s', self.total_ms(), summary)
+
+  def lazy(self, name, factory):
+    """Returns a Lazy for the result of factory."""
+    lazy = Lazy(self, name, factory)
+    self._lazies.append(lazy)
+    return lazy
+
+  def lazy_import(self, name):
+    """Returns a Lazy for the module called name."""
+    def load():
+      __import__(name)
+      return sys.modules[name]
+    return self.lazy(name, load)
+
+  def load_deferred(self, skip=()):
+    """Loads everything deferred that is not loaded yet, except the work
+    named in skip."""
+    for lazy in self._lazies:
+      if lazy._name not in skip:
+        lazy._resolve()
+
+  def report(self):
+    """Returns the phases and deferred work as a dict."""
+    return {'budget_ms': self.budget_ms,
+            'total_ms': self.total_ms(),
+            'phases': self.phases,
+            'deferred': self.deferred}
+
+
+# The start of this instance, from when this module was first imported.
+profile = Startup()
@@ -0,0 +1,158 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cheap per-request timers, aggregated into latency histograms.
+
+Code on the request path times a span by taking time.time() before the
+work and passing it to record() afterwards:
+
+  start = time.time()
+  result = cache.get(key)
+  timing.record('cache', start)
+
+Spans with the same name add up within a request, and are reported to
+the client in a Server-Timing header.  Every span is also added to a
+process-wide Histogram of that name, which dump() returns on demand:
+
+  >>> reset()
+  >>> start_request()
+  >>> record('cache', 10.0, now=10.002)
+  >>> record('cache', 20.0, now=20.001)
+  >>> server_timing_header(end_request())
+  'cache;dur=3.0'
+  >>> dump()['cache']['count']
+  2
+"""
+
+import bisect
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in milliseconds.
+BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+           1000, 2500, 5000, 10000)
+
+
+class Histogram(object):
+  """Counts of durations in fixed, roughly logarithmic buckets.
+
+  Updates are a few integer additions and are not locked; under threads
+  a concurrent update may rarely be lost, which is fine for monitoring.
+  """
+
+  def __init__(self):
+    # One more bucket than BUCKETS, for everything over the last bound.
+    self.counts = [0] * (len(BUCKETS) + 1)
+    self.count = 0
+    self.total_ms = 0.0
+
+  def add(self, ms):
+    self.counts[bisect.bisect_left(BUCKETS, ms)] += 1
+    self.count += 1
+    self.total_ms += ms
+
+  def percentile(self, fraction):
+    """Returns the upper bound of the bucket holding the percentile.
+
+    Beyond the last bucket there is no bound, which is returned as the
+    string '+Inf', as in Prometheus, since JSON has no infinity:
+
+      >>> histogram = Histogram()
+      >>> histogram.add(1.0)
+      >>> histogram.add(20000.0)
+      >>> histogram.percentile(0.5), histogram.percentile(0.99)
+      (1.0, '+Inf')
+    """
+    if not self.count:
+      return 0.0
+    rank = fraction * self.count
+    seen = 0
+    for i, count in enumerate(self.counts):
+      seen += count
+      if seen >= rank:
+        if i < len(BUCKETS):
+          return float(BUCKETS[i])
+        break
+    return '+Inf'
+
+  def summary(self):
+    """Returns the histogram as a dict of plain values."""
+    return {'count': self.count,
+            'total_ms': self.total_ms,
+            'mean_ms': self.count and self.total_ms / self.count or 0.0,
+            'p50_ms': self.percentile(0.50),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'buckets': zip(BUCKETS + ('inf',), self.counts)}
+
+
+histograms = {}
+_local = threading.local()
+
+
+def histogram(name):
+  """Returns the process-wide histogram called name, creating it."""
+  result = histograms.get(name)
+  if result is None:
+    result = histograms[name] = Histogram()
+  return result
+
+
+def start_request():
+  """Starts collecting spans for the request handled by this thread."""
+  _local.spans = {}
+
+
+def end_request():
+  """Stops collecting and returns the request's {name: [count, ms]}."""
+  spans = getattr(_local, 'spans', None)
+  _local.spans = None
+  return spans or {}
+
+
+def current_spans():
+  """Returns the spans collected so far for this thread's request."""
+  return getattr(_local, 'spans', None) or {}
+
+
+def record(name, start, now=None):
+  """Records a span called name that began at time start."""
+  if now is None:
+    now = time.time()
+  ms = (now - start) * 1000.0
+  histogram(name).add(ms)
+  spans = getattr(_local, 'spans', None)
+  if spans is not None:
+    span = spans.get(name)
+    if span is None:
+      spans[name] = [1, ms]
+    else:
+      span[0] += 1
+      span[1] += ms
+
+
+def server_timing_header(spans):
+  """Formats spans as the value of a Server-Timing header."""
+  return ', '.join(['%s;dur=%.1f' % (name, spans[name][1])
+                    for name in sorted(spans)])
+
+
+def dump():
+  """Returns a summary of every histogram, keyed by name."""
+  return dict([(name, h.summary()) for name, h in histograms.items()])
+
+
+def reset():
+  """Forgets every histogram."""
+  histograms.clear()
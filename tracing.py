@@ -0,0 +1,102 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Lazily formatted request tracing that can be switched on at runtime.
+
+Request paths log through this module rather than by formatting strings
+for logging.debug themselves:
+
+  tracing.debug('Checking cache for %s', local_key)
+
+Arguments are only formatted when tracing is enabled, and code that logs
+several times in a row can test tracing.enabled once and skip the calls
+altogether.
+
+Tracing is switched on and off for every instance at once by storing a
+flag in the cache.  Each instance rereads the flag at most once every
+REFRESH_INTERVAL seconds, so no restart is needed.
+"""
+
+import logging
+import time
+
+FLAG_KEY = 'tracing:enabled'
+REFRESH_INTERVAL = 10
+
+# True when debug messages are both switched on and would be emitted.
+enabled = False
+
+_default = False
+_next_refresh = 0
+_logger = logging.getLogger()
+
+
+def init(default=False):
+  """Sets the state used while no flag is stored in the cache.
+
+  Args:
+    default: Whether tracing is on when nobody has switched it.
+  """
+  global _default, _next_refresh
+  _default = default
+  _next_refresh = 0
+  _apply(default)
+
+
+def _apply(switch):
+  global enabled
+  enabled = bool(switch) and _logger.isEnabledFor(logging.DEBUG)
+
+
+def refresh(cache, now=None):
+  """Rereads the tracing flag if REFRESH_INTERVAL has passed.
+
+  Args:
+    cache: An object with a memcache style get method.
+    now: The current time in seconds, defaults to time.time().
+  """
+  global _next_refresh
+  if now is None:
+    now = time.time()
+  if now < _next_refresh:
+    return
+  _next_refresh = now + REFRESH_INTERVAL
+  switch = cache.get(FLAG_KEY)
+  if switch is None:
+    switch = _default
+  _apply(switch)
+
+
+def set_enabled(cache, switch):
+  """Switches tracing on or off for every instance.
+
+  Args:
+    cache: An object with a memcache style set method.
+    switch: True to turn tracing on, False to turn it off.
+  """
+  global _next_refresh
+  cache.set(FLAG_KEY, bool(switch))
+  _next_refresh = 0
+  _apply(switch)
+
+
+def debug(msg, *args):
+  """Logs msg % args at debug level if tracing is enabled."""
+  if enabled:
+    _logger.debug(msg, *args)
+
+
+def warning(msg, *args):
+  """Logs msg % args at warning level, formatting only if emitted."""
+  _logger.warning(msg, *args)
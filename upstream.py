@@ -0,0 +1,500 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Guards calls to upstream hosts with circuit breakers and deadlines.
+
+Every host gets a CircuitBreaker.  When too many of the recent fetches to
+a host fail, the breaker opens and further fetches fail immediately
+instead of waiting out the full timeout.  After a cooldown a single probe
+is let through, and its outcome decides whether the breaker closes again.
+
+Each request may also start a Deadline, a time budget shared by all of
+the fetches made while handling it.
+
+Here a fake upstream fails twice and the breaker opens:
+
+  >>> clock = FakeClock()
+  >>> def dead_host(url, deadline):
+  ...   raise IOError('connection refused')
+  >>> breakers = Breakers(min_requests=2, cooldown=30, clock=clock)
+  >>> for i in range(2):
+  ...   try:
+  ...     fetch('http://friendfeed.com/a', dead_host, breakers=breakers)
+  ...   except FetchError:
+  ...     pass
+  >>> fetch('http://friendfeed.com/a', dead_host, breakers=breakers)
+  Traceback (most recent call last):
+  ...
+  CircuitOpenError: friendfeed.com
+
+Once the cooldown has passed, one successful probe closes it again:
+
+  >>> class Response(object):
+  ...   status_code = 200
+  >>> clock.now += 30
+  >>> fetch('http://friendfeed.com/a', lambda url, deadline: Response(),
+  ...       breakers=breakers).status_code
+  200
+  >>> breakers.get('friendfeed.com').state
+  'closed'
+
+A request can start fetching several urls at once with prefetch, and a
+later fetch of one of them returns its response instead of fetching it
+again, so the request waits for the slowest fetch rather than for all
+of them in turn:
+
+  >>> class Started(object):
+  ...   def get_result(self):
+  ...     return Response()
+  >>> start_request(5)
+  >>> prefetch('http://friendfeed.com/b', lambda url, deadline: Started(),
+  ...          breakers=breakers)
+  True
+  >>> response = fetch('http://friendfeed.com/b', dead_host, breakers=breakers)
+  >>> response.status_code
+  200
+  >>> end_request()
+
+Only so many requests, across every instance, may be waiting on
+upstream at once.  A request takes a place with its first fetch and
+keeps it until it ends.  Beyond the limit, requests wait briefly for a
+place and then fail fast rather than queue behind the rest.  Requests
+served from the cache never take a place.  An instance handles one
+request at a time, so the places are counted in the cache the instances
+share:
+
+  >>> import backends
+  >>> cache = backends.LocalCache()
+  >>> admission = Admission(limit=1)
+  >>> place = admission.enter(cache)
+  >>> print admission.enter(cache)
+  None
+  >>> admission.leave(cache, place)
+  >>> admission.active(cache)
+  0
+"""
+
+import collections
+import sys
+import threading
+import time
+import urlparse
+
+import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# The longest a single fetch may take, in seconds.
+FETCH_TIMEOUT = 10
+# How many requests, across every instance, may be waiting on upstream
+# at once, and how long a request may wait for one of them to finish.
+# Places are given up quickly while upstream is healthy, so requests are
+# only refused once it is slow.
+MAX_UPSTREAM_REQUESTS = 50
+ADMISSION_WAIT = 0.25
+# How often a waiting request looks for a place, and how long the places
+# are counted under one key; see Admission.
+ADMISSION_POLL = 0.05
+ADMISSION_WINDOW = 60
+ADMISSION_KEY_PREFIX = 'admission:'
+
+
+FETCHES = metrics.Counter(
+  'upstream_fetches', 'Upstream fetches by host and outcome.',
+  ('host', 'outcome'))
+ADMISSIONS = metrics.Counter(
+  'upstream_admissions', 'Requests that needed upstream, by outcome.',
+  ('outcome',))
+FETCH_LATENCY = metrics.Histogram(
+  'upstream_latency_ms', 'Latency of upstream fetches that were made.',
+  ('host',))
+
+
+class UpstreamError(Exception):
+  """Base class for errors raised instead of a response."""
+
+
+class CircuitOpenError(UpstreamError):
+  """Raised without fetching when the breaker for a host is open."""
+
+
+class BudgetExhaustedError(UpstreamError):
+  """Raised without fetching when the request deadline has passed."""
+
+
+class AdmissionError(UpstreamError):
+  """Raised without fetching when too many requests are waiting on
+  upstream already."""
+
+
+class FetchError(UpstreamError):
+  """Raised when the fetch itself failed."""
+
+
+class FakeClock(object):
+  """A clock for tests that only moves when told to."""
+
+  def __init__(self, now=0.0):
+    self.now = now
+
+  def __call__(self):
+    return self.now
+
+
+class CircuitBreaker(object):
+  """Tracks the recent failure rate of one upstream host.
+
+  The breaker opens once at least min_requests fetches were made in the
+  last window seconds and failure_ratio of them failed.  It stays open
+  for cooldown seconds, then lets one probe through.
+  """
+
+  def __init__(self, window=60, min_requests=5, failure_ratio=0.5,
+               cooldown=30, clock=time.time):
+    self.window = window
+    self.min_requests = min_requests
+    self.failure_ratio = failure_ratio
+    self.cooldown = cooldown
+    self.state = CLOSED
+    self._clock = clock
+    self._outcomes = collections.deque()
+    self._failures = 0
+    self._opened_at = None
+
+  def _trim(self, now):
+    outcomes = self._outcomes
+    horizon = now - self.window
+    while outcomes and outcomes[0][0] < horizon:
+      if outcomes.popleft()[1]:
+        self._failures -= 1
+
+  def allow(self):
+    """Returns True if a fetch may be made now."""
+    if self.state == CLOSED:
+      return True
+    if self.state == OPEN and self._clock() >= self._opened_at + self.cooldown:
+      # Let exactly one probe through; others fail fast until it returns.
+      self.state = HALF_OPEN
+      return True
+    return False
+
+  def record(self, failed):
+    """Records the outcome of a fetch that allow() let through."""
+    now = self._clock()
+    if self.state == HALF_OPEN:
+      if failed:
+        self._open(now)
+      else:
+        self.state = CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+      return
+    self._trim(now)
+    self._outcomes.append((now, failed))
+    if failed:
+      self._failures += 1
+      count = len(self._outcomes)
+      if (count >= self.min_requests and
+          self._failures >= self.failure_ratio * count):
+        self._open(now)
+
+  def _open(self, now):
+    self.state = OPEN
+    self._opened_at = now
+
+
+class Breakers(object):
+  """A CircuitBreaker per host, created on first use."""
+
+  def __init__(self, **kwargs):
+    self._kwargs = kwargs
+    self._breakers = {}
+
+  def get(self, host):
+    breaker = self._breakers.get(host)
+    if breaker is None:
+      breaker = self._breakers[host] = CircuitBreaker(**self._kwargs)
+    return breaker
+
+  def states(self):
+    """Returns a dict of each host to the state of its breaker."""
+    return dict([(host, breaker.state)
+                 for host, breaker in self._breakers.items()])
+
+
+class Admission(object):
+  """Counts the requests waiting on upstream in a shared cache, up to a
+  limit.
+
+  Each place is counted under the key of the window of time in which it
+  was taken, and the places taken are those counted in the current and
+  the previous window.  A place that is never given up, because its
+  instance died, is forgotten once its window has passed.
+  """
+
+  def __init__(self, limit=MAX_UPSTREAM_REQUESTS, window=ADMISSION_WINDOW,
+               clock=time.time, sleep=time.sleep):
+    self.limit = limit
+    self.window = window
+    self._clock = clock
+    self._sleep = sleep
+
+  def _keys(self):
+    """Returns the keys of the current and the previous window."""
+    index = int(self._clock() // self.window)
+    return ('%s%d' % (ADMISSION_KEY_PREFIX, index),
+            '%s%d' % (ADMISSION_KEY_PREFIX, index - 1))
+
+  def active(self, cache):
+    """Returns the number of places taken."""
+    return sum(cache.get_multi(self._keys()).values())
+
+  def enter(self, cache, timeout=0):
+    """Takes a place, waiting up to timeout seconds for one to be given
+    up.
+
+    Returns:
+      The key the place was counted under, for leave, or None if there
+      was no place.  If the cache cannot count, a place is given anyway.
+    """
+    give_up_at = self._clock() + timeout
+    while True:
+      current, previous = self._keys()
+      count = cache.incr(current, initial_value=0)
+      if count is None:
+        return current
+      if count + (cache.get(previous) or 0) <= self.limit:
+        return current
+      cache.decr(current)
+      if self._clock() + ADMISSION_POLL > give_up_at:
+        return None
+      self._sleep(ADMISSION_POLL)
+
+  def leave(self, cache, key):
+    """Gives up a place taken by enter."""
+    cache.decr(key)
+
+
+class Deadline(object):
+  """A time budget shared by every fetch made for one request."""
+
+  def __init__(self, budget, clock=time.time):
+    self._clock = clock
+    self.expires = clock() + budget
+
+  def remaining(self):
+    """Returns the seconds left, which may be zero or negative."""
+    return self.expires - self._clock()
+
+
+breakers = Breakers()
+admission = Admission()
+_local = threading.local()
+
+
+def start_request(budget, clock=time.time, cache=None):
+  """Starts the deadline for the request handled by this thread.  If a
+  cache is given, the request also takes a place in admission, counted
+  in cache, when it first fetches."""
+  _local.deadline = Deadline(budget, clock)
+  _local.pending = {}
+  _local.cache = cache
+  # False until the first fetch takes a place; None if none is needed.
+  _local.admitted = None
+  if cache is not None:
+    _local.admitted = False
+  _local.shed = False
+
+
+def end_request():
+  """Clears the deadline for the request handled by this thread, waits
+  for the prefetches it did not use, so that their outcomes still count
+  against their breakers, and gives up its place in admission."""
+  _local.deadline = None
+  pending, _local.pending = getattr(_local, 'pending', None), None
+  try:
+    for call in (pending or {}).values():
+      try:
+        call.get_result()
+      except Exception:
+        # Whatever went wrong was recorded against the breaker already.
+        pass
+  finally:
+    if getattr(_local, 'admitted', None):
+      admission.leave(_local.cache, _local.admitted)
+    _local.admitted = _local.cache = None
+    _local.shed = False
+
+
+class PendingFetch(object):
+  """A fetch that was started and whose outcome has not been read."""
+
+  def __init__(self, host, breaker, call, errors, start):
+    self._host = host
+    self._breaker = breaker
+    self._call = call
+    self._errors = errors
+    self._start = start
+    self._response = None
+    self._error = None
+
+  def get_result(self):
+    """Waits for the fetch and returns its response.
+
+    Raises:
+      FetchError: if the fetch failed, every time it is called.
+    """
+    if self._call is not None:
+      call, self._call = self._call, None
+      try:
+        self._response = _record(self._host, self._breaker, self._start,
+                                 call.get_result, self._errors)
+      except Exception, e:
+        self._error = e
+    if self._error is not None:
+      raise self._error
+    return self._response
+
+
+class _Failed(object):
+  """Stands in for a fetch that failed as it was started."""
+
+  def __init__(self, exc_info):
+    self._exc_info = exc_info
+
+  def get_result(self):
+    raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+
+
+def _admit(url, breakers):
+  """Returns the host, timeout and breaker for a fetch of url, or raises
+  an UpstreamError if it may not be made."""
+  host = urlparse.urlparse(url)[1]
+  timeout = FETCH_TIMEOUT
+  deadline = getattr(_local, 'deadline', None)
+  if deadline is not None:
+    timeout = min(timeout, deadline.remaining())
+    if timeout <= 0:
+      FETCHES.inc((host, 'budget_exhausted'))
+      raise BudgetExhaustedError(host)
+  # Before the breaker, which must hear back from any fetch it allows.
+  # A request that was refused once fails every later fetch at once,
+  # rather than wait for a place again.
+  if getattr(_local, 'shed', False):
+    FETCHES.inc((host, 'shed'))
+    raise AdmissionError(host)
+  if getattr(_local, 'admitted', None) is False:
+    place = admission.enter(_local.cache, ADMISSION_WAIT)
+    if place is None:
+      _local.shed = True
+      ADMISSIONS.inc(('shed',))
+      FETCHES.inc((host, 'shed'))
+      raise AdmissionError(host)
+    ADMISSIONS.inc(('admitted',))
+    _local.admitted = place
+  breaker = breakers.get(host)
+  if not breaker.allow():
+    FETCHES.inc((host, 'circuit_open'))
+    raise CircuitOpenError(host)
+  return host, timeout, breaker
+
+
+def _record(host, breaker, start, func, errors):
+  """Calls func for a response, and records its outcome."""
+  try:
+    response = func()
+  except errors, e:
+    breaker.record(True)
+    FETCHES.inc((host, 'error'))
+    raise FetchError('%s: %s' % (host, e))
+  except:
+    breaker.record(True)
+    FETCHES.inc((host, 'error'))
+    raise
+  FETCH_LATENCY.observe((host,), (time.time() - start) * 1000.0)
+  failed = response.status_code >= 500
+  breaker.record(failed)
+  FETCHES.inc((host, failed and 'server_error' or 'ok'))
+  return response
+
+
+def fetch(url, fetch_func, errors=Exception, breakers=breakers):
+  """Fetches url through its host's breaker and the request deadline.
+
+  If url was prefetched by this request, the prefetch's outcome is
+  returned instead.
+
+  Args:
+    url: The url to fetch.
+    fetch_func: Called as fetch_func(url, deadline=seconds) and returns a
+      response with a status_code.
+    errors: The exception class, or tuple of classes, that fetch_func
+      raises when a fetch fails.  These count against the breaker and are
+      raised again as FetchError.
+    breakers: The Breakers to use, for tests.
+  Returns:
+    The response returned by fetch_func.  Responses with a 5xx status
+    are returned, but count as failures.
+  """
+  pending = getattr(_local, 'pending', None)
+  if pending and url in pending:
+    return pending.pop(url).get_result()
+  host, timeout, breaker = _admit(url, breakers)
+  start = time.time()
+  return _record(host, breaker, start,
+                 lambda: fetch_func(url, deadline=timeout), errors)
+
+
+def fetch_async(url, start_func, errors=Exception, breakers=breakers):
+  """Starts fetching url through its host's breaker and the request
+  deadline.
+
+  Args:
+    url: The url to fetch.
+    start_func: Called as start_func(url, deadline=seconds) and returns
+      an object whose get_result() returns the response.
+    errors: The exceptions that start_func and get_result raise when the
+      fetch fails.
+    breakers: The Breakers to use, for tests.
+  Returns:
+    A PendingFetch.
+  """
+  host, timeout, breaker = _admit(url, breakers)
+  start = time.time()
+  try:
+    call = start_func(url, deadline=timeout)
+  except:
+    # Failing to start counts as the fetch failing, once it is read.
+    call = _Failed(sys.exc_info())
+  return PendingFetch(host, breaker, call, errors, start)
+
+
+def prefetch(url, start_func, errors=Exception, breakers=breakers):
+  """Starts fetching url for a later fetch of it by this request.
+
+  Returns:
+    True if the fetch was started.  Urls already prefetched, urls that
+    may not be fetched now, and any url outside of a request are left
+    to be fetched when they are needed.
+  """
+  pending = getattr(_local, 'pending', None)
+  if pending is None or url in pending:
+    return False
+  try:
+    pending[url] = fetch_async(url, start_func, errors, breakers)
+  except UpstreamError:
+    return False
+  return True
@@ -0,0 +1,235 @@
+# Copyright 2008 DeWitt Clinton
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Keeps the most requested users' pages from going cold.
+
+Each instance counts requests per nickname in memory, and every
+FLUSH_INTERVAL seconds merges its counts into a per-bucket dict in the
+cache.  The last WINDOW buckets together say who is popular right now.
+
+A cron job then calls Warmer.warm, which re-renders the pages of the
+most popular users.  While it runs, cached results that would expire
+within the horizon are treated as misses, so they are recomputed and
+stored again, and results that are still fresh for longer are reused.
+
+Popular users share many friends, so before rendering the users' pages
+the warmer can refresh each friend's data once, most shared first, in
+batches whose fetches are started together:
+
+
+  >>> import backends, upstream
+  >>> clock = upstream.FakeClock(6000)
+  >>> cache = backends.LocalCache(clock=clock)
+  >>> warmer = Warmer(clock=clock)
+  >>> for nickname in ['bob', 'al', 'bob']:
+  ...   warmer.track(cache, nickname)
+  >>> clock.now += FLUSH_INTERVAL
+  >>> warmer.track(cache, 'bob')
+  >>> warmer.popular(cache)
+  [('bob', 3), ('al', 1)]
+  >>> def render(nickname):
+  ...   print nickname, horizon()
+  >>> def render_friend(friend):
+  ...   print 'friend', friend
+  >>> def prefetch_friends(friends):
+  ...   print 'prefetch', friends
+  >>> friends = {'bob': ['carol', 'dave'], 'al': ['dave']}.get
+  >>> warmer.warm(cache, render, horizon_seconds=900,
+  ...             friends=friends, render_friend=render_friend,
+  ...             prefetch_friends=prefetch_friends)
+  prefetch ['dave', 'carol']
+  friend dave
+  friend carol
+  bob 900
+  al 900
+  ['bob', 'al']
+  >>> sorted(warmer.fan_in.items())
+  [('carol', ['bob']), ('dave', ['bob', 'al'])]
+  >>> horizon()
+  0
+"""
+
+import logging
+import threading
+import time
+
+import metrics
+
+KEY_PREFIX = 'warming:hits:'
+FLUSH_INTERVAL = 60
+BUCKET_SECONDS = 600
+WINDOW = 6
+MAX_TRACKED = 1000
+# The share of the budget the friends may take; the users always get
+# the rest.
+FRIEND_SHARE = 0.5
+# How many friends' fetches are started together.
+FRIEND_BATCH = 20
+
+WARMED = metrics.Counter(
+  'warmed', 'Users and friends that were re-rendered, by outcome.',
+  ('kind', 'outcome'))
+
+_local = threading.local()
+
+
+def horizon():
+  """Returns how many seconds ahead of expiry this thread refreshes."""
+  return getattr(_local, 'horizon', 0)
+
+
+class Warmer(object):
+  """Tracks the popularity of users and re-renders the popular ones."""
+
+  def __init__(self, clock=time.time):
+    self._clock = clock
+    self._lock = threading.Lock()
+    self._counts = {}
+    self._next_flush = clock() + FLUSH_INTERVAL
+    # The users that include each friend, as of the last run.
+    self.fan_in = {}
+
+  def track(self, cache, nickname):
+    """Counts a request for nickname, and flushes the counts if due."""
+    self._lock.acquire()
+    try:
+      self._counts[nickname] = self._counts.get(nickname, 0) + 1
+      now = self._clock()
+      if now < self._next_flush:
+        return
+      self._next_flush = now + FLUSH_INTERVAL
+      counts, self._counts = self._counts, {}
+    finally:
+      self._lock.release()
+    self.flush(cache, counts, now)
+
+  def flush(self, cache, counts, now=None):
+    """Adds counts to the current bucket in the cache.
+
+    Concurrent flushes from other instances may be lost, which only
+    makes the counts a little less accurate.
+    """
+    if now is None:
+      now = self._clock()
+    key = '%s%d' % (KEY_PREFIX, int(now // BUCKET_SECONDS))
+    bucket = cache.get(key) or {}
+    for nickname, count in counts.items():
+      bucket[nickname] = bucket.get(nickname, 0) + count
+    if len(bucket) > MAX_TRACKED:
+      bucket = dict(_top(bucket, MAX_TRACKED))
+    cache.set(key, bucket, BUCKET_SECONDS * (WINDOW + 1))
+
+  def popular(self, cache, limit=50):
+    """Returns the most requested (nickname, count) pairs in the window."""
+    current = int(self._clock() // BUCKET_SECONDS)
+    keys = [str(current - i) for i in xrange(WINDOW)]
+    totals = {}
+    for bucket in cache.get_multi(keys, key_prefix=KEY_PREFIX).values():
+      for nickname, count in bucket.items():
+        totals[nickname] = totals.get(nickname, 0) + count
+    return _top(totals, limit)
+
+  def warm(self, cache, render, limit=50, horizon_seconds=900, budget=None,
+           friends=None, render_friend=None, prefetch_friends=None):
+    """Re-renders the pages of the most popular users.
+
+    Args:
+      cache: The cache holding the popularity counts.
+      render: A function that renders every page of a user, given their
+        nickname, through the cacheable functions.
+      limit: The number of users to warm.
+      horizon_seconds: Results expiring within this many seconds are
+        recomputed.
+      budget: Seconds after which to stop, leaving the rest for the
+        next run.  The friends may take FRIEND_SHARE of it, and the
+        users always get the rest.
+      friends: A function returning the friends of a user.
+      render_friend: A function that refreshes what the pages of every
+        user share about a friend, called first, once per friend, for
+        the friends included by the most users first.
+      prefetch_friends: A function that starts refreshing a list of
+        friends at once, called before render_friend for each batch of
+        FRIEND_BATCH of them.
+    Returns:
+      The nicknames that were warmed.
+    """
+    if budget is None:
+      stop_at = friends_stop_at = None
+    else:
+      stop_at = self._clock() + budget
+      friends_stop_at = self._clock() + budget * FRIEND_SHARE
+    _local.horizon = horizon_seconds
+    try:
+      users = [nickname for nickname, count in self.popular(cache, limit)]
+      if friends and render_friend:
+        self.fan_in = reverse_index(users, friends)
+        self._run('friend', by_fan_in(self.fan_in), render_friend,
+                  friends_stop_at, prefetch_friends, FRIEND_BATCH)
+      return self._run('user', users, render, stop_at)
+    finally:
+      _local.horizon = 0
+
+  def _run(self, kind, names, render, stop_at, prefetch=None, batch=None):
+    done = []
+    for i, name in enumerate(names):
+      if stop_at is not None and self._clock() >= stop_at:
+        WARMED.inc((kind, 'skipped'), len(names) - i)
+        break
+      if prefetch and i % batch == 0:
+        try:
+          prefetch(names[i:i + batch])
+        except Exception:
+          logging.exception('Could not prefetch %s %s', kind, name)
+      try:
+        render(name)
+      except Exception:
+        logging.exception('Could not warm %s %s', kind, name)
+        WARMED.inc((kind, 'error'))
+        continue
+      WARMED.inc((kind, 'ok'))
+      done.append(name)
+    return done
+
+
+def reverse_index(users, friends):
+  """Returns a dict of each friend of users to the users including them.
+
+  Users whose friends cannot be listed are left out.
+  """
+  index = {}
+  for user in users:
+    try:
+      user_friends = friends(user)
+    except Exception:
+      logging.exception('Could not list the friends of %s', user)
+      continue
+    for friend in user_friends:
+      index.setdefault(friend, []).append(user)
+  return index
+
+
+def by_fan_in(index):
+  """Returns the friends in index, included by the most users first."""
+  return [friend for friend, count in
+          _top(dict([(friend, len(users)) for friend, users in index.items()]),
+               len(index))]
+
+
+def _top(counts, limit):
+  pairs = counts.items()
+  pairs.sort(key=lambda pair: (-pair[1], pair[0]))
+  return pairs[:limit]
+
+
+warmer = Warmer()
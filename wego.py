@@ -12,35 +12,104 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gzip
 import logging
 
 logging.debug('Beginning main.py')
 
-import os
+# Imported first, to time the imports that follow.
+import startup
 
-from google.appengine.api import memcache
-from google.appengine.api import urlfetch
-from google.appengine.ext import webapp
-from google.appengine.ext.webapp import template, Request, Response
-from google.appengine.ext.webapp.util import run_wsgi_app
+import os
+import time
+from StringIO import StringIO
 
+import backends
+import cachekeys
 import decorator
-import simplejson
+import metrics
+import namespaces
+import profiler
+import sharding
+import singleflight
+import timing
+import tracing
+import upstream
+import warming
 import webob
 import webob.exc
 import wsgidispatcher
 
+# Most requests are served from the cache or redirected, and never need
+# to render a template or parse JSON, so those are imported on first use.
+simplejson = startup.profile.lazy_import('simplejson')
+template = startup.profile.lazy_import('google.appengine.ext.webapp.template')
+
+startup.profile.mark('imports')
 
 CREF_MIMETYPE = 'text/xml'
 ANNOTATIONS_MIMETYPE = 'text/xml'
 OSD_MIMETYPE = 'application/opensearchdescription+xml'
 CACHE_EXPIRATION = 3600
+# Annotation shards are keyed by their contents, so they can be kept for
+# as long as memcache will keep them, and cached by clients for a year.
+SHARD_KEY_PREFIX = 'shard:'
+SHARD_EXPIRATION = 86400 * 30
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+STALE_EXPIRATION = 86400
+NEGATIVE_EXPIRATION = 300
+UPSTREAM_BUDGET = 20
+# When to retry a request that was refused for want of upstream capacity.
+OVERLOADED_RETRY_AFTER = 10
+WARM_USERS = 50
+# Must be well under CACHE_EXPIRATION, or warming recomputes everything.
+WARM_HORIZON = 900
+WARM_BUDGET = 15
+LEASE_WAIT = 3
+# What a warm instance knows that a new one should start with, saved by
+# the warm cron job and read by warmup requests.
+SNAPSHOT_KEY = 'warmup:snapshot'
+SNAPSHOT_EXPIRATION = 86400
+# Smaller bodies are not worth the gzip header and the client's effort.
+GZIP_MIN_SIZE = 256
+GZIP_LEVEL = 6
 TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+# The size of the positional shards listed by older cref files.
 MAX_FRIENDS_PER_ANNOTATION = 5
-MAX_ANNOTATIONS = 49
-MAX_FRIENDS = MAX_FRIENDS_PER_ANNOTATION * MAX_ANNOTATIONS
 ANNOTATIONS_URL_TEMPLATE = 'http://ego-ego.appspot.com/friendfeed/%s/annotations/list/'
 
+# The cache and fetcher every request goes through.  Tests and benchmarks
+# can replace them with the local stand-ins from backends.
+cache, fetcher = backends.default_backends()
+
+# Where the last known good profiles and annotations are kept, so that
+# they survive the cache.  Only misses need it, so it is opened on first
+# use.  A request reads each key once, and saves what it wrote when it
+# ends, in one batch.
+store = backends.BufferedStore(
+  startup.profile.lazy('store', backends.default_store))
+
+# The version counters that namespace every cacheable result.
+versions = namespaces.Versions()
+
+# The computations of single_flight results running in this instance.
+flights = singleflight.Group()
+
+# The average size of the annotations fetched by this instance.
+annotation_sizes = sharding.SizeEstimate()
+
+startup.profile.mark('backends')
+
+REQUESTS = metrics.Counter(
+  'requests', 'Requests served, by route and status.', ('route', 'status'))
+REQUEST_LATENCY = metrics.Histogram(
+  'request_latency_ms', 'Time to handle a request, by route.', ('route',))
+BYTES_SERVED = metrics.Counter(
+  'bytes_served', 'Response body bytes served, by route.', ('route',))
+CACHE_LOOKUPS = metrics.Counter(
+  'cache_lookups', 'Lookups by cacheable functions, by result.',
+  ('function', 'result'))
+
 class ReportableError(Exception):
   """A class of exceptions that should be shown to the user."""
   message = None
@@ -66,31 +135,107 @@ class RemoteError(ReportableError):
   """An error caused by remote services."""
 
 
+class OverloadedError(RemoteError):
+  """A 503 error, raised when too many requests are waiting on remote
+  services already to admit another."""
+
+
 class TemplateResponse(webob.Response):
   def __init__(self, template_name, template_data=None, *args, **kwargs):
     super(TemplateResponse, self).__init__(*args, **kwargs)
     if template_data is None:
       template_data = {}
     path = os.path.join(TEMPLATE_DIR, template_name)
+    start = time.time()
     self.body = template.render(path, template_data)
+    timing.record('template', start)
+    # Compressed along with rendering, so that a cached response carries
+    # its gzip variant and is never compressed again.
+    if len(self.body) >= GZIP_MIN_SIZE:
+      self.gzip_body = gzip_compress(self.body)
+    else:
+      self.gzip_body = None
+
+
+def gzip_compress(data):
+  """Returns data compressed in the gzip format."""
+  start = time.time()
+  buffer = StringIO()
+  gzip_file = gzip.GzipFile(fileobj=buffer, mode='wb',
+                            compresslevel=GZIP_LEVEL)
+  try:
+    gzip_file.write(data)
+  finally:
+    gzip_file.close()
+  timing.record('gzip', start)
+  return buffer.getvalue()
+
+
+def negotiate_encoding(request, response):
+  """Returns the response in the encoding the client accepts best.
+
+  Only responses that carry a gzip_body have a choice of encodings; the
+  others are returned as they are.  Either way a response with a choice
+  is marked as varying by Accept-Encoding, so that shared caches keep
+  both variants.  The response itself may be in the cache, so a new one
+  is returned rather than changing it.
+  """
+  gzip_body = getattr(response, 'gzip_body', None)
+  if not gzip_body:
+    return response
+  headerlist = [(name, value) for name, value in response.headerlist
+                if name.lower() not in ('content-length', 'content-encoding')]
+  negotiated = webob.Response(status=response.status, headerlist=headerlist)
+  vary = negotiated.headers.get('Vary')
+  if vary:
+    negotiated.headers['Vary'] = '%s, Accept-Encoding' % vary
+  else:
+    negotiated.headers['Vary'] = 'Accept-Encoding'
+  if 'gzip' in request.accept_encoding:
+    negotiated.headers['Content-Encoding'] = 'gzip'
+    negotiated.body = gzip_body
+  else:
+    negotiated.body = response.body
+  return negotiated
 
 
-def cacheable(keygen=None, expiration=CACHE_EXPIRATION):
+def cacheable(keygen=None, namespace=None, expiration=CACHE_EXPIRATION,
+              stale_expiration=STALE_EXPIRATION,
+              negative_expiration=NEGATIVE_EXPIRATION, single_flight=False,
+              persist=False):
   """A decorator that caches results in memcache.
   
   keygen: 
     A function that returns the cache key based on the *args and
     **kwargs of the function being called.  If keygen is 
     not specified, the first positional argument will be used.
+  namespace:
+    A function that returns, from the same arguments, the nickname of
+    the user the result is about, or None.  Results with a nickname are
+    invalidated along with the rest of that user's results.
   expiration:
     The length of time to cache the response in seconds.
+  stale_expiration:
+    The length of time after expiration that the response is kept to
+    be served if recomputing it raises a RemoteError.
+  negative_expiration:
+    The length of time to cache an empty response in seconds.
+  single_flight:
+    Whether concurrent misses for the same key, in this instance or in
+    others, should wait for one computation rather than each compute
+    the result.
+  persist:
+    Whether results should also be saved in the store, so that they
+    survive the cache being flushed, and can be served stale for as long
+    as upstream fails.
+
+  The decorated function gets a misses method, which takes a list of
+  tuples of positional arguments and returns those that would not be
+  served from the cache or the store, with one read of each.
   """
-  # Define the decorator itself as a closure within cacheable
-  def call(f, *args, **kwargs):
-    # Don't use the cache at all if there is no expiration
-    if not expiration:
-      return f(*args, **kwargs)
-
+  def make_keys(f, args, kwargs):
+    """Returns the keys of a call as (local_key, nickname, global_key,
+    key, hashed, store_key)."""
     # Use the supplied keygen to create a local cache key
     # or use the first positional arg if none is supplied
     if keygen:
@@ -98,23 +243,253 @@ def cacheable(keygen=None, expiration=CACHE_EXPIRATION):
     else:
       local_key = args[0]
 
-    # Create a global cache key that remains stable across instances
-    global_key = '%s:%s:%s' % (f.__module__, f.__name__, local_key)
+    # Create a global cache key that remains stable across instances,
+    # and that changes when the app, function or user is invalidated.
+    name = f.__name__
+    nickname = namespace and namespace(*args, **kwargs) or None
+    global_key = '%s:%s:%s:%s' % (
+      f.__module__, name, versions.tag(cache, name, nickname), local_key)
+    # Long or unusual keys are hashed to a key memcache will accept.
+    key, hashed = cachekeys.make_key(global_key)
+    # The store outlives the version counters, so its keys leave them out.
+    store_key = None
+    if persist:
+      store_key = cachekeys.make_key(
+        '%s:%s:%s' % (f.__module__, name, local_key))[0]
+    return local_key, nickname, global_key, key, hashed, store_key
 
-    logging.debug('Checking cache for %s' % local_key)
-    result = memcache.get(global_key)
-    if result:
-      logging.debug('Found %s in cache.' % local_key)
-    else:
-      logging.debug('Cache miss for %s' % local_key)
-      result = f(*args, **kwargs)
+  # Define the decorator itself as a closure within cacheable
+  def call(f, *args, **kwargs):
+    # Don't use the cache at all if there is no expiration
+    if not expiration:
+      return f(*args, **kwargs)
+
+    name = f.__name__
+    local_key, nickname, global_key, key, hashed, store_key = make_keys(
+      f, args, kwargs)
+
+    # Entries are (fresh_until, result) pairs that outlive fresh_until by
+    # stale_expiration, so that a stale result can stand in for a fresh
+    # one while upstream is failing.  Entries under hashed keys also hold
+    # the full key, so that a hash collision reads as a miss.
+    # While warming, entries about to expire are treated as misses.
+    # Empty results are cached too, for negative_expiration, so that
+    # missing upstream data is not refetched on every request.
+    def lookup():
+      now = time.time()
+      entry = cache.get(key)
+      timing.record('cache', now)
+      if entry and hashed and entry[2:] != (global_key,):
+        tracing.warning('Cache key collision for %s.', local_key)
+        CACHE_LOOKUPS.inc((name, 'collision'))
+        return False, False
+      return entry, entry and now + warming.horizon() < entry[0]
+
+    entry, fresh = lookup()
+    if fresh:
+      result = entry[1]
+      if tracing.enabled:
+        tracing.debug('Found %s in cache.', local_key)
+      CACHE_LOOKUPS.inc((name, result and 'hit' or 'negative_hit'))
+      return result
+    if tracing.enabled:
+      tracing.debug('Cache miss for %s', local_key)
+    CACHE_LOOKUPS.inc((name, 'miss'))
+
+    def fill():
+      now = time.time()
+      saved = None
+      if persist:
+        saved = load_saved(name, nickname, store_key)
+        if saved and now + warming.horizon() < saved[0] + expiration:
+          if tracing.enabled:
+            tracing.debug('Found %s in the store.', local_key)
+          CACHE_LOOKUPS.inc((name, 'store'))
+          return save(saved[1], saved[0])
+      try:
+        result = f(*args, **kwargs)
+      except RemoteError:
+        stale = (entry and entry[1]) or (saved and saved[1])
+        if not stale:
+          raise
+        tracing.warning('Serving stale response for %s.', local_key)
+        CACHE_LOOKUPS.inc((name, 'stale'))
+        return stale
+      if persist and result:
+        save_durably(store_key, result, now)
+      return save(result, now)
+
+    def save(result, computed_at):
       if result:
-        logging.debug('Caching %s' % local_key)
-        if not memcache.add(global_key, result, expiration):
-          logging.warning('Error caching response for %s.' % local_key)
+        if tracing.enabled:
+          tracing.debug('Caching %s', local_key)
+        fresh_for, keep_for = expiration, expiration + stale_expiration
+      else:
+        fresh_for = keep_for = negative_expiration
+      # Results loaded from the store are only kept for what is left.
+      keep_for = int(keep_for - (time.time() - computed_at))
+      if keep_for > 0:
+        start = time.time()
+        value = (computed_at + fresh_for, result)
+        if hashed:
+          value += (global_key,)
+        if entry is None:
+          cached = cache.add(key, value, keep_for)
+        else:
+          cached = cache.set(key, value, keep_for)
+        timing.record('cache', start)
+        if not cached:
+          tracing.warning('Error caching response for %s.', local_key)
+      return result
+
+    if not single_flight:
+      return fill()
+
+    def fill_once():
+      if singleflight.acquire(cache, key):
+        try:
+          return fill()
+        finally:
+          singleflight.release(cache, key)
+      # The add also fails when the cache does, and then nobody is
+      # computing the result.
+      if not singleflight.held(cache, key):
+        return fill()
+      # Another instance holds the lease, so wait for its result.
+      def poll():
+        entry, fresh = lookup()
+        if fresh:
+          return entry
+      waited = singleflight.wait(poll, LEASE_WAIT)
+      if waited is None:
+        return fill()
+      CACHE_LOOKUPS.inc((name, 'waited'))
+      return waited[1]
+
+    result, shared = flights.do(key, fill_once)
+    if shared:
+      CACHE_LOOKUPS.inc((name, 'shared'))
     return result
 
-  return decorator.decorator(call)
+  def misses(f, calls):
+    """Returns the calls, as tuples of positional arguments, that would
+    compute their result rather than find it in the cache or the store."""
+    if not expiration:
+      return list(calls)
+    now = time.time() + warming.horizon()
+    if namespace:
+      versions.preload(cache, f.__name__,
+                       [namespace(*args) for args in calls])
+    keyed = [(args, make_keys(f, args, {})) for args in calls]
+    entries = cache.get_multi([keys[3] for args, keys in keyed])
+    missing = []
+    for args, (local_key, nickname, global_key, key, hashed,
+               store_key) in keyed:
+      entry = entries.get(key)
+      if (entry and (not hashed or entry[2:] == (global_key,)) and
+          now < entry[0]):
+        continue
+      missing.append((args, nickname, store_key))
+    if persist and missing:
+      saved = load_saved_multi(f.__name__, [(nickname, store_key)
+                                            for args, nickname, store_key
+                                            in missing])
+      missing = [(args, nickname, store_key)
+                 for args, nickname, store_key in missing
+                 if not (store_key in saved and
+                         now < saved[store_key][0] + expiration)]
+    return [args for args, nickname, store_key in missing]
+
+  def decorate(f):
+    wrapper = decorator.decorator(call)(f)
+    wrapper.misses = lambda calls: misses(f, calls)
+    return wrapper
+
+  return decorate
+
+
+def _invalidation_keys(function=None, nickname=None):
+  keys = ['invalidated:global']
+  if function:
+    keys.append(cachekeys.make_key('invalidated:function:%s' % function)[0])
+  if nickname:
+    keys.append(cachekeys.make_key(
+      'invalidated:nickname:%s' % nickname.lower())[0])
+  return keys
+
+
+def load_saved(function, nickname, store_key):
+  """Returns the (saved_at, result) saved under store_key, unless it was
+  saved before the function or user was last invalidated."""
+  return load_saved_multi(function, [(nickname, store_key)]).get(store_key)
+
+
+def load_saved_multi(function, saved_keys):
+  """Returns a dict of the (saved_at, result) pairs found in the store,
+  with one read, for a list of (nickname, store_key) pairs.  Results
+  saved before their function or user was last invalidated are left
+  out."""
+  start = time.time()
+  keys = {}
+  for nickname, store_key in saved_keys:
+    keys[store_key] = _invalidation_keys(function, nickname)
+  wanted = set(keys)
+  for invalidation_keys in keys.values():
+    wanted.update(invalidation_keys)
+  try:
+    try:
+      found = store.get_multi(list(wanted))
+    except Exception, e:
+      tracing.warning('Could not read %s from the store: %s',
+                      ', '.join(keys), e)
+      return {}
+  finally:
+    timing.record('store', start)
+  result = {}
+  for store_key, invalidation_keys in keys.items():
+    saved = found.get(store_key)
+    if not saved:
+      continue
+    for key in invalidation_keys:
+      if key in found and found[key][0] >= saved[0]:
+        break
+    else:
+      result[store_key] = saved
+  return result
+
+
+def save_durably(store_key, result, saved_at):
+  """Saves result in the store, logging rather than raising on failure.
+  Within a request, it is saved when the request ends; see save_buffered."""
+  start = time.time()
+  try:
+    try:
+      store.put(store_key, result, saved_at)
+    except Exception, e:
+      tracing.warning('Could not save %s in the store: %s', store_key, e)
+  finally:
+    timing.record('store', start)
+
+
+def save_buffered():
+  """Saves what this request wrote to the store, logging rather than
+  raising on failure."""
+  start = time.time()
+  try:
+    try:
+      store.end_request()
+    except Exception, e:
+      tracing.warning('Could not save to the store: %s', e)
+  finally:
+    timing.record('store', start)
+
+
+def invalidate(function=None, nickname=None):
+  """Invalidates the cached and saved results for one user, one
+  function, or everything.  Returns the new version, or None."""
+  key = _invalidation_keys(function, nickname)[-1]
+  save_durably(key, True, time.time())
+  return versions.bump(cache, function=function, nickname=nickname)
 
 
 def request_keygen(request, *args, **kwargs):
@@ -128,19 +503,67 @@ def request_keygen(request, *args, **kwargs):
   return request.path
 
 
-@cacheable()    
-def get_url(url):
+def request_namespace(request, nickname, *args, **kwargs):
+  """Returns the nickname of the user a view is about."""
+  return nickname
+
+
+@cacheable(namespace=lambda url, nickname=None: nickname)
+def get_url(url, nickname=None):
   """Retrieves a URL and caches the results.
   
   Args:
     url: A url to be fetched
+    nickname: The user the url is about, if any, so that invalidating
+      the user refetches it.
   Returns:
     a http response
+  Raises:
+    OverloadedError: if too many requests are waiting on upstream.
+    RemoteError: if the host's circuit breaker is open, the request's
+      upstream budget is spent, the fetch itself failed, or the host
+      answered with a server error.
+
+  A server error is raised rather than returned, so that it is never
+  cached over a good response, and the callers serve their last good
+  result instead:
+
+    >>> import wego
+    >>> saved = wego.cache, wego.fetcher, wego.store
+    >>> wego.cache, wego.store = backends.LocalCache(), backends.SqliteStore()
+    >>> profile_url = ('http://friendfeed.com/api/user/bob/profile'
+    ...                '?include=name,nickname,subscriptions')
+    >>> wego.fetcher = backends.LocalFetcher(
+    ...   {profile_url: backends.FetchResponse('', 503)})
+    >>> get_url(profile_url, nickname='bob')
+    Traceback (most recent call last):
+    ...
+    RemoteError
+    >>> save_durably('wego:get_friendfeed_profile:bob', {'nickname': 'bob'},
+    ...              time.time() - 2 * CACHE_EXPIRATION)
+    >>> get_friendfeed_profile('bob')
+    {'nickname': 'bob'}
+    >>> wego.fetcher.fixtures[profile_url] = '{"nickname": "bob"}'
+    >>> get_url(profile_url, nickname='bob').status_code
+    200
+    >>> wego.cache, wego.fetcher, wego.store = saved
   """
-  return urlfetch.fetch(url)
-
-
-@cacheable()
+  start = time.time()
+  try:
+    try:
+      response = upstream.fetch(url, fetcher.fetch, errors=fetcher.errors)
+    except upstream.AdmissionError, e:
+      raise OverloadedError(str(e))
+    except upstream.UpstreamError, e:
+      raise RemoteError(str(e))
+  finally:
+    timing.record('fetch', start)
+  if response.status_code >= 500:
+    raise RemoteError('%s returned %d' % (url, response.status_code))
+  return response
+
+
+@cacheable(namespace=lambda nickname: nickname, persist=True)
 def get_friendfeed_profile(nickname):
   """Return a friendfeed profile object for a given nickname."""
 
@@ -150,21 +573,23 @@ def get_friendfeed_profile(nickname):
   friendfeed_profile_url = (
     'http://friendfeed.com/api/user/%s/profile?include=name,nickname,subscriptions' % nickname)
 
-  result = get_url(friendfeed_profile_url)
+  result = get_url(friendfeed_profile_url, nickname=nickname)
   if result.status_code == 404:
     raise UserError('User %s not found' % nickname)
   elif result.status_code == 401:
     raise UserError('User %s is private' % nickname)
   elif result.status_code != 200:
-    raise ServerError('Unknown friendfeed code' % result.status_code)
+    raise ServerError('Unknown friendfeed code %d' % result.status_code)
 
   friendfeed_profile_json = result.content
 
   if not friendfeed_profile_json:
     raise ServerError('could not load friendfeed user %s' % nickname)
 
-  logging.debug('Decoding profile for %s' % nickname)
+  tracing.debug('Decoding profile for %s', nickname)
+  start = time.time()
   friendfeed_profile = simplejson.loads(friendfeed_profile_json)
+  timing.record('json', start)
   if not friendfeed_profile:
     raise ServerError('could not parse friendfeed user %s' % nickname)
 
@@ -190,10 +615,10 @@ def get_friend_nicknames(friendfeed_profile):
     try:
       friend_nickname = subscription['nickname']
     except:
-      logging.warning('No nickname for %s' % subscription)
+      tracing.warning('No nickname for %s', subscription)
       continue
     if not friend_nickname:
-      logging.warning('No nickname for %s' % subscription)
+      tracing.warning('No nickname for %s', subscription)
       continue
     friend_nicknames.append(friend_nickname.lower())
   return friend_nicknames
@@ -201,42 +626,42 @@ def get_friend_nicknames(friendfeed_profile):
 
 def NotFoundView(request):
   """Print a 404 page"""
-  logging.debug('Beginning NotFound handler')
+  tracing.debug('Beginning NotFound handler')
   return TemplateResponse('404.tmpl', status='404 Not Found')
 
 
 def ExceptionView(request, *args, **kwargs):
   """Print a 500 page"""
-  logging.debug('Beginning ExceptionView handler')
+  tracing.debug('Beginning ExceptionView handler')
   return TemplateResponse('500.tmpl', status='500 Server Error')
 
 
 @cacheable(keygen=request_keygen)
 def HomeView(request):
   """Prints the wego wego homepage"""
-  logging.debug('Beginning HomeView handler')
+  tracing.debug('Beginning HomeView handler')
   return TemplateResponse('home.tmpl')
 
 
 @cacheable(keygen=request_keygen)
 def FaqView(request):
-  logging.debug('Beginning FaqView handler')
+  tracing.debug('Beginning FaqView handler')
   return TemplateResponse('faq.tmpl')
 
 
 def UserRedirectView(request):
   """Redirects a form POST to the user view."""
-  logging.debug('Beginning UserRedirectView handler')
+  tracing.debug('Beginning UserRedirectView handler')
   nickname = request.POST.get('nickname')
   if not nickname:
     raise UserError('nickname required')
   return webob.exc.HTTPSeeOther(location=('/friendfeed/%s/' % nickname))
 
 
-@cacheable(keygen=request_keygen)
+@cacheable(keygen=request_keygen, namespace=request_namespace)
 def UserView(request, nickname):
   """A request handler that generates a few demos."""
-  logging.debug('Beginning UserView handler')
+  tracing.debug('Beginning UserView handler')
   if not request.path.islower():
     return webob.exc.HTTPMovedPermanently(location=request.path.lower())
   friendfeed_profile = get_friendfeed_profile(nickname)
@@ -245,10 +670,10 @@ def UserView(request, nickname):
   return TemplateResponse('user.tmpl', template_data)
 
 
-@cacheable(keygen=request_keygen)
+@cacheable(keygen=request_keygen, namespace=request_namespace)
 def OsdView(request, nickname):
   """A request handler that generates an opensearch description document."""
-  logging.debug('Beginning OsdView handler')
+  tracing.debug('Beginning OsdView handler')
   if not request.path.islower():
     return webob.exc.HTTPMovedPermanently(location=request.path.lower())
   friendfeed_profile = get_friendfeed_profile(nickname)
@@ -257,42 +682,190 @@ def OsdView(request, nickname):
   return TemplateResponse('osd.tmpl', template_data, content_type=OSD_MIMETYPE)
 
 
-@cacheable(keygen=request_keygen)
+@cacheable(keygen=request_keygen, namespace=request_namespace)
 def CrefView(request, nickname):
   """A request handler that generates CustomSearch cref files."""
-  logging.debug('Beginning CrefView handler')
+  tracing.debug('Beginning CrefView handler')
   if not request.path.islower():
     return webob.exc.HTTPMovedPermanently(location=request.path.lower())
   friendfeed_profile = get_friendfeed_profile(nickname)
   name = get_friendfeed_name(friendfeed_profile, nickname)
-  # Shard the annotations such that we include no more than 50 files
-  # and none of those files contain more than 5 friends.  Users that have
-  # more than 250 friends will have a truncated CSE.
-  num_friends = min(MAX_FRIENDS, len(get_friend_nicknames(friendfeed_profile)))
-  num_pages = max(1, (num_friends / MAX_FRIENDS_PER_ANNOTATION))
-  start_indexes = [i * MAX_FRIENDS_PER_ANNOTATION for i in xrange(num_pages)]
+  # Shard the annotations by a hash of each friend's nickname, into as
+  # few files as keep each one small.  Every friend is included.  Shards
+  # whose annotations are all at hand are listed under the digest of
+  # their contents; the rest are listed without one, so that the cref
+  # file never waits on, or fails with, a fetch of an annotation.
+  partition = get_shards(friendfeed_profile)
+  missing = set([friend_nickname for (friend_nickname,) in
+                 get_annotation.misses([(friend_nickname,) for friend_nickname
+                                        in get_friend_nicknames(
+                                          friendfeed_profile)])])
+  shards = []
+  for index, friend_nicknames in enumerate(partition):
+    digest = None
+    if not missing.intersection(friend_nicknames):
+      digest = render_cached_shard(friend_nicknames)
+    shards.append({'index': index, 'digest': digest})
   template_data = {'nickname': nickname, 
                    'name':  name,
-                   'start_indexes': start_indexes}
+                   'shards': shards,
+                   'shard_count': len(shards)}
   return TemplateResponse('cref.tmpl', template_data, content_type=CREF_MIMETYPE)
 
 
-@cacheable()
+@cacheable(namespace=lambda friend_nickname: friend_nickname,
+           single_flight=True, persist=True)
 def get_annotation(friend_nickname):
   """Retrieve the annotation file for given user."""
   url = ANNOTATIONS_URL_TEMPLATE % friend_nickname
-  result = get_url(url)
+  result = get_url(url, nickname=friend_nickname)
   if result.status_code != 200:
-    logging.debug('Could not load %s' % url)
+    tracing.debug('Could not load %s', url)
     annotation = ''
   else:
+    annotation_sizes.add(len(result.content))
     return result.content
 
 
-@cacheable(keygen=request_keygen)
+def get_annotation_or_empty(friend_nickname):
+  """Returns the annotation file for a friend, or '' if it could not be
+  loaded and there is no stale copy, so that one friend cannot fail the
+  page of every user who includes them.
+
+  Raises:
+    OverloadedError: so that a shed request is still refused quickly.
+  """
+  try:
+    return get_annotation(friend_nickname)
+  except OverloadedError:
+    raise
+  except RemoteError, e:
+    tracing.warning('Leaving out the annotation of %s: %s',
+                    friend_nickname, e.message)
+    return ''
+
+
+def prefetch_annotations(friend_nicknames):
+  """Starts fetching, all at once, the annotations that get_annotation
+  would otherwise fetch one after the other for friend_nicknames.
+
+  Only annotations that are in neither the cache nor the store, and
+  whose urls are not cached either, are fetched.  Returns the number of
+  fetches started.
+  """
+  missing = get_annotation.misses([(friend_nickname,)
+                                   for friend_nickname in friend_nicknames])
+  urls = get_url.misses([(ANNOTATIONS_URL_TEMPLATE % friend_nickname,
+                          friend_nickname)
+                         for (friend_nickname,) in missing])
+  started = 0
+  for url, friend_nickname in urls:
+    if upstream.prefetch(url, fetcher.fetch_async, errors=fetcher.errors):
+      started += 1
+  if started and tracing.enabled:
+    tracing.debug('Prefetching %d annotations.', started)
+  return started
+
+
+def get_shards(friendfeed_profile, shards=None):
+  """Returns the friends of a user in each of their annotation shards.
+
+  Args:
+    friendfeed_profile: The user's profile.
+    shards: The number of shards, or None for the current number.
+  """
+  friend_nicknames = get_friend_nicknames(friendfeed_profile)
+  if shards is None:
+    shards = sharding.shard_count(len(friend_nicknames),
+                                  annotation_sizes.average)
+  return sharding.partition(friend_nicknames, shards)
+
+
+def render_shard(friend_nicknames, prefetch=True):
+  """Renders the annotations of friends, and stores them and their gzip
+  variant under their digest.
+
+  Args:
+    friend_nicknames: The friends in the shard.
+    prefetch: Whether to start fetching the missing annotations at once
+      first, rather than leave that to the caller.
+  Returns:
+    The digest, the rendered annotations, and their gzip variant, or
+    None if they are too small to compress.
+
+  Friends whose annotation cannot be loaded are left out of the shard
+  rather than fail it:
+
+    >>> import wego
+    >>> saved = wego.cache, wego.fetcher, wego.store
+    >>> wego.cache, wego.store = backends.LocalCache(), backends.SqliteStore()
+    >>> wego.fetcher = backends.LocalFetcher(
+    ...   {ANNOTATIONS_URL_TEMPLATE % 'al': 'annotations-of-al',
+    ...    ANNOTATIONS_URL_TEMPLATE % 'bo': backends.FetchResponse('', 503)})
+    >>> digest, content, gzip_body = render_shard(['al', 'bo'])
+    >>> content.split()
+    ['<Annotations>', 'annotations-of-al', '</Annotations>']
+    >>> wego.cache, wego.fetcher, wego.store = saved
+  """
+  if prefetch:
+    prefetch_annotations(friend_nicknames)
+  annotations = [get_annotation_or_empty(friend_nickname)
+                 for friend_nickname in friend_nicknames]
+  rendered = TemplateResponse('annotations.tmpl', {'annotations': annotations})
+  content, gzip_body = rendered.body, rendered.gzip_body
+  digest = sharding.digest(content)
+  cache.set(SHARD_KEY_PREFIX + digest, (content, gzip_body), SHARD_EXPIRATION)
+  return digest, content, gzip_body
+
+
+def render_cached_shard(friend_nicknames):
+  """Renders a shard whose annotations are cached or stored, and returns
+  its digest, or None if it could not be rendered."""
+  try:
+    return render_shard(friend_nicknames, False)[0]
+  except Exception:
+    logging.exception('Could not render the shard of %s',
+                      ', '.join(friend_nicknames))
+    return None
+
+
+def AnnotationShardView(request, nickname, shard, shards, digest=None):
+  """A request handler that generates one shard of the annotations of a
+  user's friends, as listed by the user's cref file.
+
+  The cref file lists each shard under the digest of its contents.  The
+  contents of such a URL never change, so it is served from the cache
+  without looking at the profile, and may be cached by clients for a
+  year.  Other URLs get the current contents with the usual expiration.
+  """
+  tracing.debug('Beginning AnnotationShardView handler')
+  if not request.path.islower():
+    return webob.exc.HTTPMovedPermanently(location=request.path.lower())
+  stored = digest and cache.get(SHARD_KEY_PREFIX + digest)
+  if isinstance(stored, tuple):
+    content, gzip_body = stored
+    if tracing.enabled:
+      tracing.debug('Found shard %s in cache.', digest)
+  else:
+    shard, shards = int(shard), int(shards)
+    if not 0 < shards <= sharding.MAX_SHARDS or shard >= shards:
+      return webob.exc.HTTPNotFound()
+    friend_nicknames = get_shards(get_friendfeed_profile(nickname), shards)[shard]
+    content, gzip_body = render_shard(friend_nicknames)[1:]
+  response = webob.Response(content, content_type=ANNOTATIONS_MIMETYPE)
+  response.gzip_body = gzip_body
+  if digest and digest == sharding.digest(content):
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+  else:
+    response.headers['Cache-Control'] = 'public, max-age=%d' % CACHE_EXPIRATION
+  return response
+
+
+@cacheable(keygen=request_keygen, namespace=request_namespace)
 def AnnotationView(request, nickname, start_index=None):
-  """A request handler that generates CustomSearch annotation file."""
-  logging.debug('Beginning AnnotationView handler')
+  """A request handler that generates the positional annotation shards
+  listed by cref files from before AnnotationShardView."""
+  tracing.debug('Beginning AnnotationView handler')
   if not request.path.islower():
     return webob.exc.HTTPMovedPermanently(location=request.path.lower())
   if start_index is None:
@@ -303,22 +876,213 @@ def AnnotationView(request, nickname, start_index=None):
   all_friend_nicknames = get_friend_nicknames(friendfeed_profile)
   end_index = min(len(all_friend_nicknames), start_index + MAX_FRIENDS_PER_ANNOTATION)
   friend_nicknames = all_friend_nicknames[start_index:end_index]
-  annotations = [get_annotation(friend_nickname) for friend_nickname in friend_nicknames]
+  prefetch_annotations(friend_nicknames)
+  annotations = [get_annotation_or_empty(friend_nickname)
+                 for friend_nickname in friend_nicknames]
   template_data = {'annotations': annotations}
   return TemplateResponse(
     'annotations.tmpl', template_data, content_type=ANNOTATIONS_MIMETYPE)
 
 
+def warm_user(nickname):
+  """Renders a user's profile and cref pages, and with the cref page
+  every one of their annotation shards that is cached."""
+  path = '/friendfeed/%s/' % nickname
+  UserView(webob.Request.blank(path), nickname)
+  CrefView(webob.Request.blank(path + 'cref/'), nickname)
+
+
+def WarmView(request):
+  """Re-renders the most requested users' pages before they expire.
+
+  Run by cron; see cron.yaml.
+  """
+  warmed = warming.warmer.warm(
+    cache, warm_user, WARM_USERS, WARM_HORIZON, WARM_BUDGET,
+    friends=lambda nickname: get_friend_nicknames(
+      get_friendfeed_profile(nickname)),
+    render_friend=get_annotation, prefetch_friends=prefetch_annotations)
+  save_snapshot()
+  lines = ['warmed %d users' % len(warmed)]
+  for friend in warming.by_fan_in(warming.warmer.fan_in)[:20]:
+    lines.append('%s is included by %d of them' % (
+      friend, len(warming.warmer.fan_in[friend])))
+  return webob.Response('\n'.join(lines) + '\n', content_type='text/plain')
+
+
+def save_snapshot():
+  """Saves what new instances should start with: the average annotation
+  size, which decides how users' annotations are sharded.  Nothing is
+  saved until this instance has measured some annotations, so that the
+  snapshot of another instance is not replaced with the default."""
+  if not annotation_sizes.count:
+    return
+  snapshot = {'annotation_bytes': annotation_sizes.average}
+  if not cache.set(SNAPSHOT_KEY, snapshot, SNAPSHOT_EXPIRATION):
+    tracing.warning('Could not save the warmup snapshot.')
+
+
+def prepare_instance(skip=()):
+  """Does the work that the first requests to an instance would
+  otherwise do: loads the deferred modules and store, except those named
+  in skip, compiles every template and renders the error pages.  Returns
+  the names of the templates."""
+  startup.profile.load_deferred(skip)
+  templates = sorted([name for name in os.listdir(TEMPLATE_DIR)
+                      if name.endswith('.tmpl')])
+  for name in templates:
+    template.load(os.path.join(TEMPLATE_DIR, name))
+  dispatcher.prerender()
+  return templates
+
+
+def WarmupView(request):
+  """Prepares a new instance before it is sent user requests.
+
+  Besides prepare_instance, adopts, from the snapshot saved by the warm
+  cron job, the average annotation size of the warm instances.  See
+  app.yaml.
+
+  Users' pages are not loaded here: they are kept in memcache, which the
+  instance shares already, and not in the instance itself, so loading
+  them would not make its first requests any faster.
+  """
+  start = time.time()
+  snapshot = cache.get(SNAPSHOT_KEY) or {}
+  if snapshot.get('annotation_bytes'):
+    annotation_sizes.average = float(snapshot['annotation_bytes'])
+  templates = prepare_instance()
+  startup.profile.record('warmup', start)
+  lines = ['compiled %d templates' % len(templates),
+           'took %.1fms' % ((time.time() - start) * 1000.0)]
+  return webob.Response('\n'.join(lines) + '\n', content_type='text/plain')
+
+
 def ResetView(request):
-  """Flushes the caches."""
-  memcache.flush_all()
+  """Invalidates every cached result."""
+  invalidate()
   return webob.exc.HTTPSeeOther(location='/')  
 
 
-def StatsView(request):
-  """Prints a page of memcache stats."""
-  template_data = {'stats': memcache.get_stats()}
-  return TemplateResponse('stats.tmpl', template_data)
+def InvalidateView(request):
+  """Invalidates the cached results for a user, a function or the app."""
+  nickname = request.POST.get('nickname')
+  function = request.POST.get('function')
+  if not nickname and not function and request.POST.get('all') != '1':
+    raise UserError('nickname, function or all=1 required')
+  version = invalidate(function=function, nickname=nickname)
+  if version is None:
+    raise ServerError('could not update the cache')
+  return webob.Response('invalidated %s, now version %d\n' % (
+    nickname or function or 'everything', version), content_type='text/plain')
+
+
+def TracingView(request):
+  """Switches per-request debug tracing on or off on every instance."""
+  tracing.set_enabled(cache, request.POST.get('enabled') == '1')
+  return webob.Response(
+    'tracing %s\n' % (tracing.enabled and 'enabled' or 'disabled'),
+    content_type='text/plain')
+
+
+def TimingView(request):
+  """Dumps this instance's latency histograms as JSON."""
+  return webob.Response(simplejson.dumps(timing.dump(), indent=2),
+                        content_type='application/json')
+
+
+def StartupView(request):
+  """Dumps how long this instance took to start, by phase, and the work
+  it deferred to first use, as JSON."""
+  return webob.Response(simplejson.dumps(startup.profile.report(), indent=2),
+                        content_type='application/json')
+
+
+def MetricsView(request):
+  """Prints this instance's metrics as HTML, JSON or Prometheus text."""
+  format = request.GET.get('format')
+  if format == 'prometheus':
+    return webob.Response(metrics.prometheus_text(),
+                          content_type='text/plain; version=0.0.4')
+  if format == 'json':
+    return webob.Response(simplejson.dumps(metrics.snapshot()),
+                          content_type='application/json')
+  return TemplateResponse('metrics.tmpl', {'metrics': metrics.snapshot()})
+
+
+def ProfileView(request):
+  """Prints the aggregated profile of the sampled requests."""
+  try:
+    limit = int(request.GET.get('limit', 60))
+  except ValueError:
+    raise UserError('limit must be a number')
+  return webob.Response(
+    profiler.sampler.report(cache, request.GET.get('sort', 'cumulative'),
+                            limit),
+    content_type='text/plain')
+
+
+def ProfileConfigView(request):
+  """Sets the profiling rate and token, or discards the profile."""
+  if request.POST.get('reset') == '1':
+    profiler.sampler.reset(cache)
+    return webob.Response('profile discarded\n', content_type='text/plain')
+  try:
+    rate = int(request.POST.get('rate') or 0)
+  except ValueError:
+    raise UserError('rate must be a number')
+  profiler.sampler.configure(cache, rate, request.POST.get('token'))
+  sampled = []
+  if rate:
+    sampled.append('1 in %d requests' % rate)
+  if profiler.sampler.token:
+    sampled.append('requests with the token')
+  return webob.Response(
+    'profiling %s\n' % (' and '.join(sampled) or 'disabled'),
+    content_type='text/plain')
+
+
+def _memcache_stats():
+  return dict([((name,), value) for name, value in cache.get_stats().items()])
+
+
+def _compression_ratio():
+  stats = cache.get_stats()
+  return (float(stats['bytes_before_compression']) /
+          max(1, stats['bytes_after_compression']))
+
+
+def _in_process_entries():
+  entries = {('wrapper_factories',): len(decorator._factories),
+             ('timing_histograms',): len(timing.histograms),
+             ('circuit_breakers',): len(upstream.breakers.states()),
+             ('single_flight',): flights.in_flight()}
+  if isinstance(getattr(cache, 'cache', cache), backends.LocalCache):
+    entries[('local_cache',)] = cache.get_stats()['items']
+  return entries
+
+
+metrics.Gauge('memcache', 'Statistics reported by the cache backend.',
+              _memcache_stats, ('stat',))
+metrics.Gauge('cache_compression_ratio',
+              'Bytes before compression per byte stored, when compressed.',
+              _compression_ratio)
+metrics.Gauge('in_process_entries', 'Entries held in in-process caches.',
+              _in_process_entries, ('cache',))
+metrics.Gauge('startup_ms', 'Time this instance took to start, by phase.',
+              lambda: dict([((phase,), ms)
+                            for phase, ms in startup.profile.phases]),
+              ('phase',))
+metrics.Gauge('upstream_bound_requests',
+              'Requests waiting on upstream on every instance, and how many '
+              'may be.',
+              lambda: {('active',): upstream.admission.active(cache),
+                       ('limit',): upstream.admission.limit},
+              ('kind',))
+metrics.Gauge('circuit_breakers_open', 'Upstream hosts failing fast.',
+              lambda: dict([((host,), int(state != upstream.CLOSED))
+                            for host, state in upstream.breakers.states().items()]),
+              ('host',))
 
 
 class Dispatcher(object):
@@ -334,11 +1098,44 @@ class Dispatcher(object):
 
   def get_app(self):
     """Returns a WSGIApplication instance."""
-    return self._urls;
+    return self._timed
+
+  def _timed(self, environ, start_response):
+    """Times and counts the request, and reports its spans in a
+    Server-Timing header."""
+    start = time.time()
+    environ['wego.start'] = start
+    timing.start_request()
+    statuses = []
+    def timed_start_response(status, headers, exc_info=None):
+      statuses.append(status)
+      spans = timing.current_spans()
+      header = timing.server_timing_header(spans)
+      total = 'total;dur=%.1f' % ((time.time() - start) * 1000.0)
+      if header:
+        header = '%s, %s' % (header, total)
+      else:
+        header = total
+      return start_response(status, headers + [('Server-Timing', header)],
+                            exc_info)
+    body = None
+    try:
+      body = self._urls(environ, timed_start_response)
+      return body
+    finally:
+      timing.record('request', start)
+      timing.end_request()
+      route = environ.get('wego.route', 'unrouted')
+      status = statuses and statuses[-1][:3] or '500'
+      REQUESTS.inc((route, status))
+      REQUEST_LATENCY.observe((route,), (time.time() - start) * 1000.0)
+      if isinstance(body, list):
+        BYTES_SERVED.inc((route,), sum([len(chunk) for chunk in body]))
 
   @staticmethod
   def _redirect_with_slash(environ, start_response):
     """Redirects to the same page with a trailing redirect."""
+    environ['wego.route'] = 'redirect'
     new_url = environ['SCRIPT_NAME'] + '/'
     start_response('301 Moved Permanently', 
                    [('content-type', 'text/html'),
@@ -347,25 +1144,82 @@ class Dispatcher(object):
 
   class _make_request(object):
     """A private wrapper class around functions to help them support WSGI."""
-    def __init__(self, f, error_handler=None):
+    def __init__(self, f, error_handler=None, route=None):
       self._f = f
       self._error_handler = error_handler
+      self._route = route
 
     def __call__(self, environ, start_response):
+      timing.record('route', environ.get('wego.start', time.time()))
+      environ['wego.route'] = self._route
+      tracing.refresh(cache)
+      if profiler.sampler.wants(environ, cache):
+        return profiler.sampler.runcall(
+          cache, self._call, environ, start_response)
+      return self._call(environ, start_response)
+
+    def _call(self, environ, start_response):
       request = webob.Request(environ)
       try:
         kwargs = environ['wsgiorg.routing_args'][1]
       except KeyError:
         kwargs = {}
+      if 'nickname' in kwargs:
+        warming.warmer.track(cache, kwargs['nickname'].lower())
+      upstream.start_request(UPSTREAM_BUDGET, cache=cache)
+      versions.start_request()
+      store.start_request()
       try:
-        response = self._f(request, **kwargs)
+        try:
+          response = self._f(request, **kwargs)
+        finally:
+          upstream.end_request()
+          versions.end_request()
+          save_buffered()
+      except OverloadedError, e:
+        # Refused quickly, without rendering, so that shedding load is
+        # cheap; responses that were cached are still served.
+        if tracing.enabled:
+          tracing.debug('Shedding %s: %s', request.path, e.message)
+        response = webob.exc.HTTPServiceUnavailable(
+          headers={'Retry-After': str(OVERLOADED_RETRY_AFTER)})
       except BaseException, e:
         if self._error_handler:
           return self._error_handler(environ, start_response)
         else:
           raise e
+      response = negotiate_encoding(request, response)
       return response(environ, start_response)
 
+  class _make_prerendered(object):
+    """A private wrapper class that renders a view once and replays it.
+
+    Error pages do not depend on the request, and they are served in
+    bursts exactly when the application is under the most stress, so the
+    response is rendered on first use and replayed from bytes after that.
+    """
+    def __init__(self, f, route=None):
+      self._f = f
+      self._route = route
+      self._status = None
+      self._headers = None
+      self._body = None
+
+    def __call__(self, environ, start_response):
+      if self._route:
+        environ['wego.route'] = self._route
+      self.prerender(webob.Request(environ))
+      start_response(self._status, list(self._headers))
+      return [self._body]
+
+    def prerender(self, request):
+      """Renders the response, unless it was rendered already."""
+      if self._status is None:
+        response = self._f(request)
+        self._headers = tuple(response.headerlist)
+        self._body = response.body
+        self._status = response.status
+
   def add_get_handler(self, path, f, error_handler=None):
     """Add a new route between GET requests to path and the named function.
 
@@ -377,7 +1231,7 @@ class Dispatcher(object):
     """
     if error_handler is None:
       error_handler = self._error_handler
-    self._urls.add(path, GET=self._make_request(f, error_handler))
+    self._urls.add(path, GET=self._make_request(f, error_handler, path))
     if path.endswith('/'):
       self._urls.add(path[0:-1], GET=self._redirect_with_slash)
 
@@ -389,19 +1243,29 @@ class Dispatcher(object):
     """
     if error_handler is None:
       error_handler = self._error_handler
-    self._urls.add(path, POST=self._make_request(f, error_handler))
+    self._urls.add(path, POST=self._make_request(f, error_handler, path))
 
   def add_not_found_handler(self, f):
-    self._urls.handle404 = self._make_request(f)
+    """Serves the response of f, rendered once, for unmatched paths."""
+    self._urls.handle404 = self._make_prerendered(f, 'not_found')
 
   def add_error_handler(self, f):
-    self._error_handler = self._make_request(f)
+    """Serves the response of f, rendered once, when a handler raises."""
+    self._error_handler = self._make_prerendered(f)
+
+  def prerender(self):
+    """Renders the not found and error pages ahead of their first use."""
+    for handler in (self._urls.handle404, self._error_handler):
+      if isinstance(handler, self._make_prerendered):
+        handler.prerender(webob.Request.blank('/'))
 
 def init():
   logging.debug('Beginning init()')
   global dispatcher
   dispatcher = Dispatcher()
-  if not os.environ['SERVER_SOFTWARE'].startswith('Dev'):
+  is_dev_server = os.environ.get('SERVER_SOFTWARE', '').startswith('Dev')
+  tracing.init(default=is_dev_server)
+  if not is_dev_server:
     dispatcher.add_error_handler(ExceptionView)
   dispatcher.add_get_handler('/', HomeView)
   dispatcher.add_get_handler('/faq/', FaqView)
@@ -409,18 +1273,35 @@ def init():
   dispatcher.add_get_handler('/friendfeed/{nickname:word}/', UserView)
   dispatcher.add_get_handler('/friendfeed/{nickname:word}/osd/', OsdView)
   dispatcher.add_get_handler('/friendfeed/{nickname:word}/cref/', CrefView)
+  dispatcher.add_get_handler(
+    '/friendfeed/{nickname:word}/annotations/{shard:digits}-of-{shards:digits}/',
+    AnnotationShardView)
+  dispatcher.add_get_handler(
+    '/friendfeed/{nickname:word}/annotations/{shard:digits}-of-{shards:digits}/{digest:word}/',
+    AnnotationShardView)
   dispatcher.add_get_handler(
     '/friendfeed/{nickname:word}/annotations[/{start_index:digits}]/', 
     AnnotationView)
   # dispatcher.add_post_handler('/resetresetreset/', ResetView)
-  dispatcher.add_get_handler('/statsstatsstats/', StatsView)
+  dispatcher.add_get_handler('/admin/metrics/', MetricsView)
+  dispatcher.add_post_handler('/admin/invalidate/', InvalidateView)
+  dispatcher.add_post_handler('/admin/tracing/', TracingView)
+  dispatcher.add_get_handler('/admin/timing/', TimingView)
+  dispatcher.add_get_handler('/admin/startup/', StartupView)
+  dispatcher.add_get_handler('/admin/warm/', WarmView)
+  dispatcher.add_get_handler('/_ah/warmup', WarmupView)
+  dispatcher.add_get_handler('/admin/profile/', ProfileView)
+  dispatcher.add_post_handler('/admin/profile/', ProfileConfigView)
   dispatcher.add_not_found_handler(NotFoundView)
 
 # Call static initializer once
 init()
+startup.profile.mark('init')
+startup.profile.check()
 
 def main():
   logging.debug('Beginning main()')
+  from google.appengine.ext.webapp.util import run_wsgi_app
   run_wsgi_app(dispatcher.get_app())
   
 if __name__ == '__main__':
@@ -418,11 +418,15 @@ Example::
         if ranges:
             self.ranges.update(ranges)
 
+    _404_body = "<h1>File Not Found</h1>"
+    _404_headers = (('Content-Type', "text/html"),
+                    ('Content-Length', str(len(_404_body))))
+
     def _404(self, environ, start_response):
         """ The default 404 response for Dispatcher. You can pass in your
         own app to handle 404s to __init__."""
-        start_response("404 Not Found", [('Content-Type', "text/html")])
-        return ["<h1>File Not Found</h1>"]
+        start_response("404 Not Found", list(self._404_headers))
+        return [self._404_body]
 
     def __call__(self, environ, start_response):
         """An instance of a Dispatcher is a callable that is